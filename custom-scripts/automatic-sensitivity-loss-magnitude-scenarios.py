@@ -7,12 +7,12 @@ Description: Find global/total sensitivity loss and local sensitivity loss for m
 import os
 from astropy.io import fits
 import numpy as np
+from fits_output import read_map
+from prefetch_io import StageTimer, list_fits_files, prefetch_fits_files
 
-def fits_to_numpy_array(file_path): #what the title says
-    with fits.open(file_path) as hdulist:
-        data_array = hdulist[0].data
-        header = hdulist[0].header
-    return data_array, header
+def fits_to_numpy_array(file_path): #what the title says, read_map also handles tile-compressed loss maps
+    data_array, header = read_map(file_path)
+    return np.array(data_array), header #off the memmap, so the prefetch thread does the decoding
 
 def find_dimensions(data_array): #for troubleshooting
     if data_array.ndim == 2:
@@ -51,26 +51,34 @@ def get_coordinates(arcsecond_offset):
     }
     return coordinates.get(arcsecond_offset, (None, None))
 
-def process_files(directory):
+def process_files(directory, read_ahead=2):
+    timer = StageTimer()
     results = []
-    for filename in os.listdir(directory):
+    file_info = {} # file_path -> what we parsed out of the filename
+    for file_path in list_fits_files(directory): #maps inside bundles come out as '<bundle>/<map name>.fits'
+        filename = os.path.basename(file_path)
         if filename.endswith(".fits"):
             parts = filename.split('-')
             r_value = parts[0][1:]  # r value finder
             m_value = parts[1][1:].replace(",", "")  # m-value finder also remove the commas within it
             x_location_of_companion, y_location_of_companion = get_coordinates(r_value)
             if x_location_of_companion is not None and y_location_of_companion is not None:
-                file_path = os.path.join(directory, filename)
-                data_array, header = fits_to_numpy_array(file_path)
-                print(f"processing: {filename} with m value: {m_value}") #sanity check
-                max_loss = round(find_max_loss(data_array), 2)
-                local_loss = round(find_local_loss(data_array, x_location_of_companion, y_location_of_companion), 2)
-                results.append((float(r_value), int(m_value), filename, max_loss, local_loss))
+                file_info[file_path] = (filename, r_value, m_value, x_location_of_companion, y_location_of_companion)
             else:
                 print(f"wrong coords for: {filename}")
+
+    # only the files with good coords get read, and the next few are decoded in the background while we compute on this one
+    for file_path, data_array, header in prefetch_fits_files(list(file_info), read_ahead=read_ahead, timer=timer, loader=fits_to_numpy_array):
+        filename, r_value, m_value, x_location_of_companion, y_location_of_companion = file_info[file_path]
+        print(f"processing: {filename} with m value: {m_value}") #sanity check
+        with timer.stage('compute'):
+            max_loss = round(find_max_loss(data_array), 2)
+            local_loss = round(find_local_loss(data_array, x_location_of_companion, y_location_of_companion), 2)
+        results.append((float(r_value), int(m_value), filename, max_loss, local_loss))
     
     results.sort(key=lambda x: (x[1], x[0]))
     write_to_txt_file(results, 'output-mags.txt')
+    timer.report()
 
 def write_to_txt_file(results, filename):
     def write_section(file, section_name, loss_values): #personal preference since the plotting script
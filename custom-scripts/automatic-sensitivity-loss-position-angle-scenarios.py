@@ -12,12 +12,12 @@ and I have been too lazy since to combine the two.
 import os
 from astropy.io import fits
 import numpy as np
+from fits_output import read_map
+from prefetch_io import StageTimer, list_fits_files, prefetch_fits_files
 
-def fits_to_numpy_array(file_path): #what the title says
-    with fits.open(file_path) as hdulist:
-        data_array = hdulist[0].data
-        header = hdulist[0].header
-    return data_array, header
+def fits_to_numpy_array(file_path): #what the title says, read_map also handles tile-compressed loss maps
+    data_array, header = read_map(file_path)
+    return np.array(data_array), header #off the memmap, so the prefetch thread does the decoding
 
 def find_dimensions(data_array): #for troubleshooting
     if data_array.ndim == 2:
@@ -121,25 +121,33 @@ def get_coordinates(arcsecond_offset, theta_offset):
     return coordinates.get(arcsecond_offset, (None, None))
 
 
-def process_files(directory):
+def process_files(directory, read_ahead=2):
+    timer = StageTimer()
     results = []
-    for filename in os.listdir(directory):
+    file_info = {} # file_path -> what we parsed out of the filename
+    for file_path in list_fits_files(directory): #maps inside bundles come out as '<bundle>/<map name>.fits'
+        filename = os.path.basename(file_path)
         if filename.endswith(".fits"):
             parts = filename.split('-')
             r_value = parts[2][1:]  
             theta_value = parts[5][5:] 
             x_location_of_companion, y_location_of_companion = get_coordinates(r_value, theta_value)
             if x_location_of_companion is not None and y_location_of_companion is not None:
-                file_path = os.path.join(directory, filename)
-                data_array, header = fits_to_numpy_array(file_path)
-                max_loss = round(find_max_loss(data_array), 2)
-                local_loss = round(find_local_loss(data_array, x_location_of_companion, y_location_of_companion, arcsec_per_pixel=0.063), 2)
-                results.append((float(r_value), int(theta_value), filename, max_loss, local_loss))
+                file_info[file_path] = (filename, r_value, theta_value, x_location_of_companion, y_location_of_companion)
             else:
                 print(f"wrong coords for: {filename}")
 
+    # same as the magnitude script, read ahead in the background while computing
+    for file_path, data_array, header in prefetch_fits_files(list(file_info), read_ahead=read_ahead, timer=timer, loader=fits_to_numpy_array):
+        filename, r_value, theta_value, x_location_of_companion, y_location_of_companion = file_info[file_path]
+        with timer.stage('compute'):
+            max_loss = round(find_max_loss(data_array), 2)
+            local_loss = round(find_local_loss(data_array, x_location_of_companion, y_location_of_companion, arcsec_per_pixel=0.063), 2)
+        results.append((float(r_value), int(theta_value), filename, max_loss, local_loss))
+
     results.sort(key=lambda x: (x[0], x[1], x[2])) 
     write_to_txt_file(results, 'output-rots.txt')
+    timer.report()
 
 def write_to_txt_file(results, filename):
     def write_section(file, section_name, loss_values):
@@ -0,0 +1,71 @@
+"""
+batched-rdi-subtraction.py
+
+Description: RDI subtraction for a whole sweep in a few big linear-algebra calls instead of one contrast_curve() per point
+give it the target image (the same for every sweep point) and a folder of reference images (one per sweep point, e.g. the
+reference scene pulled out of each simulation) and it writes one residual map per reference with the same 10 x 10 annuli x
+subsections KLIP layout the pancake scripts use. check batched_klip.py for the math.
+
+the residual maps can go straight into infinity-std.py / infinity-std-automated.py like pancake's RDI subtraction files
+"""
+import os
+import numpy as np
+from batched_klip import batched_klip_subtract
+from fits_output import OutputSettings, open_output, read_map, save_map
+from prefetch_io import StageTimer, list_fits_files, prefetch_fits_files
+
+def fits_to_numpy_array(file_path, extension=None):
+    """
+    Args:
+        file_path (string): complete path to file of interest
+        extension (int, string or None): HDU to read (index or EXTNAME), None takes the first one with data
+
+    Returns:
+        data_array, header
+    """
+    if extension is None:
+        return read_map(file_path)
+    from astropy.io import fits
+    with fits.open(file_path) as hdulist:
+        return np.array(hdulist[extension].data), hdulist[extension].header
+
+def subtract_folder(target_file, reference_folder, output_folder, target_extension=None, reference_extension=None,
+                    numbasis=None, annuli=10, subsections=10, output_settings=None, read_ahead=2):
+    """
+    subtract every reference image in reference_folder from the target in one batched KLIP run
+
+    Returns:
+        output_paths (list of strings): residual map per reference (or the bundle path when bundling)
+    """
+    timer = StageTimer()
+    target, target_header = fits_to_numpy_array(target_file, target_extension)
+    reference_paths = sorted(list_fits_files(reference_folder))
+    loader = lambda file_path: fits_to_numpy_array(file_path, reference_extension)
+    references = [data_array for _, data_array, _ in prefetch_fits_files(reference_paths, read_ahead=read_ahead, timer=timer, loader=loader)]
+    print(f"subtracting {len(references)} references from {target_file}")
+
+    with timer.stage('compute'):
+        # a reference cube (several frames per sweep point) just becomes several KLIP references for that point
+        residuals = batched_klip_subtract(target, np.stack(references), numbasis=numbasis, annuli=annuli, subsections=subsections)
+
+    bundle = open_output(output_settings, os.path.join(output_folder, 'batched-RDI-subtraction'))
+    output_paths = []
+    with timer.stage('write'):
+        for reference_path, residual in zip(reference_paths, residuals):
+            base_filename = os.path.splitext(os.path.basename(reference_path))[0]
+            output_path = os.path.join(output_folder, f'{base_filename}-batched-RDI-subtraction.fits')
+            output_paths.append(save_map(residual, target_header, output_path, output_settings, bundle))
+        if bundle is not None:
+            bundle.close()
+    timer.report()
+    return output_paths
+
+if __name__ == '__main__':
+    target_file = '' #the target simulation, same for the whole sweep
+    target_extension = None #HDU of the target image in that file, None takes the first one with data
+    reference_folder = '' #one reference image per sweep point
+    reference_extension = None
+    output_folder = ''
+    output_settings = OutputSettings(dtype=None, compression=None, quantize_level=0, bundle=None) # lossless like before, check fits_output.py for float32 / compression / bundle='fits' or 'npz'
+    subtract_folder(target_file, reference_folder, output_folder, target_extension, reference_extension,
+                    numbasis=None, annuli=10, subsections=10, output_settings=output_settings)
@@ -0,0 +1,140 @@
+"""
+batched_klip.py
+
+Description: standalone RDI/KLIP subtraction that does a whole sweep's worth of reference variants at once
+every sweep point used to pay for its own pancake.analysis.contrast_curve() subtraction (klip_annuli=10, klip_subsections=10)
+even though the target is the same every time and only the reference changes. here the image is split into the same
+annulus x subsection regions once, and for every region all the reference variants go through one stacked eigendecomposition
+(np.linalg.eigh on a variants x N x N stack) and a couple of batched matrix products, with the target side shared.
+
+the math per region (pyKLIP style):
+    T = target pixels (frames x pixels), R = reference pixels (variants x N refs x pixels), every frame mean-subtracted
+    C = R R^T                                       -- variants x N x N
+    C = V diag(lambda) V^T                          -- stacked eigh
+    Z = diag(lambda^-1/2) V^T R                     -- KL modes, variants x K x pixels
+    residual = T - (T Z^T) Z                        -- projection of the (shared) target onto each variant's modes
+
+with a single reference frame per variant (our RDI setup) that's just subtracting the best-fit scaled reference in every region.
+a variant with no usable reference data in a region (all NaN or flat) has nothing to subtract there and comes back NaN.
+tests/test_batched_klip.py checks this against a plain per-variant SVD KLIP.
+"""
+import math
+import warnings
+import numpy as np
+
+def klip_regions(shape, center=None, annuli=10, subsections=10, inner_radius=0.0, outer_radius=None):
+    """
+    split the image into annuli x subsections regions, same layout idea as pancake's klip_annuli / klip_subsections
+
+    Args:
+        shape (tuple): (rows, columns) of the images
+        center (tuple or None): (y, x) of the star, image center by default
+        annuli (int): number of equal-width annuli between inner_radius and outer_radius
+        subsections (int): number of equal-angle slices per annulus
+        inner_radius (float): pixels closer than this to the center are left out (come back as NaN)
+        outer_radius (float or None): outer edge, the farthest pixel (so the corners are included) by default
+
+    Returns:
+        regions (list of numpy int arrays): flat pixel indices of every non-empty region
+    """
+    rows, columns = shape
+    if center is None:
+        center = ((rows - 1) / 2, (columns - 1) / 2)
+    y, x = np.indices(shape)
+    radius = np.hypot(y - center[0], x - center[1]).ravel()
+    angle = np.mod(np.arctan2(y - center[0], x - center[1]), 2 * math.pi).ravel()
+    if outer_radius is None:
+        outer_radius = radius.max() + 1e-6
+    ring_edges = np.linspace(inner_radius, outer_radius, annuli + 1)
+    ring = np.digitize(radius, ring_edges) - 1 # -1 inside inner_radius, annuli outside outer_radius
+    wedge = np.minimum((angle / (2 * math.pi) * subsections).astype(int), subsections - 1)
+    regions = []
+    for ring_index in range(annuli):
+        in_ring = ring == ring_index
+        for wedge_index in range(subsections):
+            region = np.flatnonzero(in_ring & (wedge == wedge_index))
+            if region.size:
+                regions.append(region)
+    return regions
+
+def _mean_subtracted(pixels):
+    """
+    subtract every frame's own mean over the region, NaNs become 0 so they don't contribute (pyKLIP does the same)
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # frames that are all NaN in this region
+        means = np.nanmean(pixels, axis=-1, keepdims=True)
+    return np.nan_to_num(pixels - means, nan=0.0)
+
+def klip_project_region(target_pixels, reference_pixels, numbasis=None):
+    """
+    KLIP residuals of one region for every reference variant at once
+
+    Args:
+        target_pixels (numpy array): frames x pixels
+        reference_pixels (numpy array): variants x N references x pixels
+        numbasis (int or None): KL modes to subtract, all of them (N) by default
+
+    Returns:
+        residuals (numpy array): variants x frames x pixels, NaN for variants whose references have no variance in this region
+    """
+    target = _mean_subtracted(target_pixels) # shared by every variant
+    references = _mean_subtracted(reference_pixels)
+    covariance = references @ np.swapaxes(references, 1, 2) # variants x N x N, one batched matmul
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance) # ascending, one stacked decomposition
+    modes = references.shape[1] if numbasis is None else min(numbasis, references.shape[1])
+    eigenvalues = eigenvalues[:, ::-1][:, :modes]
+    eigenvectors = eigenvectors[:, :, ::-1][:, :, :modes]
+    # modes with (numerically) zero variance get dropped instead of blowing up
+    keep = eigenvalues > np.maximum(eigenvalues[:, :1], 0.0) * 1e-12
+    keep[eigenvalues[:, 0] <= 0] = False # no variance at all, e.g. a reference that's all NaN here
+    scale = np.where(keep, 1.0 / np.sqrt(np.where(keep, eigenvalues, 1.0)), 0.0)
+    kl_modes = (np.swapaxes(eigenvectors, 1, 2) @ references) * scale[:, :, np.newaxis] # variants x K x pixels
+    coefficients = kl_modes @ target.T # variants x K x frames
+    model = np.swapaxes(coefficients, 1, 2) @ kl_modes # variants x frames x pixels
+    residuals = target[np.newaxis] - model
+    residuals[~keep.any(axis=1)] = np.nan # nothing was subtracted, the mean-subtracted target isn't a residual
+    return residuals
+
+def batched_klip_subtract(target, references, numbasis=None, annuli=10, subsections=10, center=None, inner_radius=0.0, variants_per_batch=64):
+    """
+    RDI/KLIP subtraction of one target against many reference variants
+
+    Args:
+        target (numpy array): rows x columns, or frames x rows x columns (rolls)
+        references (numpy array): variants x rows x columns (one reference image per variant, like our sweeps)
+                                  or variants x N x rows x columns (several reference frames per variant)
+        numbasis (int or None): KL modes to subtract, all of them by default
+        annuli, subsections (int): region layout, 10 x 10 like the pancake calls in the simulation scripts
+        center (tuple or None): (y, x) of the star, image center by default
+        inner_radius (float): pixels inside this radius aren't subtracted and come back NaN
+        variants_per_batch (int): variants handled per linear-algebra call, caps memory for huge sweeps
+
+    Returns:
+        residuals (numpy array): variants x rows x columns (variants x frames x rows x columns for a target cube)
+    """
+    target = np.asarray(target, dtype=np.float64)
+    references = np.asarray(references, dtype=np.float64)
+    single_frame = target.ndim == 2
+    if single_frame:
+        target = target[np.newaxis]
+    if references.ndim == 3:
+        references = references[:, np.newaxis]
+    if target.ndim != 3 or references.ndim != 4:
+        raise ValueError("err! wrong dimensions.")
+    frames, rows, columns = target.shape
+    variants = references.shape[0]
+    if references.shape[2:] != (rows, columns):
+        raise ValueError(f"err! reference images are {references.shape[2:]} but the target is {(rows, columns)}")
+
+    target_flat = target.reshape(frames, rows * columns)
+    references_flat = references.reshape(variants, references.shape[1], rows * columns)
+    residuals = np.full((variants, frames, rows * columns), np.nan)
+    regions = klip_regions((rows, columns), center, annuli, subsections, inner_radius)
+    for start in range(0, variants, variants_per_batch):
+        stop = min(start + variants_per_batch, variants)
+        for region in regions:
+            residuals[start:stop, :, region] = klip_project_region(target_flat[:, region], references_flat[start:stop][:, :, region], numbasis)
+    residuals[:, np.isnan(target_flat)] = np.nan # no data in the target means no residual either
+    residuals = residuals.reshape(variants, frames, rows, columns)
+    return residuals[:, 0] if single_frame else residuals
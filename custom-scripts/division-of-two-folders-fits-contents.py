@@ -11,41 +11,11 @@ this script proceeds as follow (to be updated with annotations):
 
 """
 
-from astropy.io import fits
 import numpy as np
-import os
+from fits_output import OutputSettings, write_map
+from fits_tools import stack_fits_files #same function as always, moved to fits_tools.py so nircam-analysis stack can use it
 
-def stack_fits_files(folder_path):
-    fits_files = [f for f in os.listdir(folder_path) if f.endswith('.fits')]
-
-    if not fits_files:
-        print(f"No .fits files found in the folder: {folder_path}")
-        return None
-    stacked_data = None
-    for file_name in fits_files:
-        print(f"Processing file: {file_name}")
-        with fits.open(os.path.join(folder_path, file_name)) as hdul:
-            try:
-                data = hdul[0].data
-                if data is None:
-                    print(f"Error: No data found in file: {file_name}")
-                    continue
-                print(f"Data shape: {data.shape}")
-                if stacked_data is None:
-                    stacked_data = data
-                else:
-                    stacked_data += data
-            except Exception as e:
-                print(f"Error reading file: {file_name}: {e}")
-
-    print(f"Number of .fits files found: {len(fits_files)}")
-    if stacked_data is not None:
-        print(f"Stacked data shape: {stacked_data.shape}")
-    return stacked_data
-
-
-
-def divide_and_save(fits_folder1, fits_folder2, output_filename):
+def divide_and_save(fits_folder1, fits_folder2, output_filename, output_settings=None):
     stack1 = stack_fits_files(fits_folder1)
     stack2 = stack_fits_files(fits_folder2)
 
@@ -55,12 +25,12 @@ def divide_and_save(fits_folder1, fits_folder2, output_filename):
 
     divided_data = np.divide(stack1, stack2)
     
-    hdu = fits.PrimaryHDU(divided_data)
-    hdu.writeto(output_filename, overwrite=True)
+    write_map(divided_data, None, output_filename, output_settings)
     print(f"Division result saved to {output_filename}")
 
 #running
 folder_path1 = ''
 folder_path2 = ''
 output_file = 'folder-one-divided-by-folder-two'
-divide_and_save(folder_path1, folder_path2, output_file)
\ No newline at end of file
+output_settings = OutputSettings(dtype=None, compression=None, quantize_level=0, bundle=None) # lossless like before, check fits_output.py for float32 / compression / bundle='fits' or 'npz'
+divide_and_save(folder_path1, folder_path2, output_file, output_settings)
\ No newline at end of file
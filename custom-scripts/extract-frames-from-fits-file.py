@@ -7,9 +7,6 @@ them confusing to work with sometimes
 """
 
 from astropy.io import fits
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gs
-import numpy as np
 
 fits_file = ''
 with fits.open(fits_file) as hdulist:
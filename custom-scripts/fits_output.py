@@ -0,0 +1,354 @@
+"""
+fits_output.py
+
+Description: shared output layer for the derived maps (-std.fits, -CI.fits, -MSL-control-20.fits, division results)
+the scripts write every map uncompressed with the full input header at whatever dtype the math produced, which for a
+big sweep means thousands of files and a lot of disk. this offers more compact formats, the defaults stay lossless.
+
+three knobs, all set through OutputSettings:
+1. dtype -- None (default) keeps whatever the arithmetic produced, 'float32' halves float64 maps
+2. compression -- None (default) for plain FITS, or 'RICE_1' / 'GZIP_1' / 'GZIP_2' tile compression.
+   quantize_level is 0 by default, which means lossless GZIP of floats. quantizing is opt-in: set quantize_level to the number
+   of quantization levels per noise sigma (bigger = more precise, less compression). careful, at 16 an STD map can be off by
+   ~1.5% and the loss maps by ~0.02 mag, more than the 0.01 mag the loss scripts print. RICE_1 always quantizes floats
+3. bundle -- None writes one file per map like before, 'fits' or 'npz' collects every map of a sweep in a MapBundle
+   and writes them all to a single multi-extension FITS / NPZ archive when the bundle is closed.
+   the next stage reads bundles like a folder of maps: expand_bundles() turns a bundle into one '<bundle file>/<map name>.fits'
+   path per map and read_map() reads those, so the folder loops keep working with their usual filename handling
+
+this file has no hyphens in its name on purpose so the other scripts in this folder can import it
+"""
+import copy
+import os
+import numpy as np
+
+COMPRESSION_TYPES = ('RICE_1', 'GZIP_1', 'GZIP_2')
+BUNDLE_FORMATS = ('fits', 'npz')
+
+class OutputSettings:
+    """
+    how derived maps get written, every script takes one of these (or None for the defaults)
+
+    Args:
+        dtype (string or None): dtype to downcast to before writing, None keeps the input dtype
+        compression (string or None): None, 'RICE_1', 'GZIP_1' or 'GZIP_2'
+        quantize_level (float): quantization levels per sigma for floats in compressed HDUs, 0 (default) means lossless (GZIP only)
+        tile_shape (tuple or None): compression tile shape, None lets astropy tile row by row
+        bundle (string or None): None for one file per map, 'fits' or 'npz' to collect maps into one file
+        keep_header (bool): copy the input header onto the output map, False only keeps the bare minimum
+    """
+    def __init__(self, dtype=None, compression=None, quantize_level=0.0, tile_shape=None, bundle=None, keep_header=True):
+        if compression is not None and compression not in COMPRESSION_TYPES:
+            raise ValueError(f"err! compression must be one of {COMPRESSION_TYPES} or None, got {compression}")
+        if bundle is not None and bundle not in BUNDLE_FORMATS:
+            raise ValueError(f"err! bundle must be one of {BUNDLE_FORMATS} or None, got {bundle}")
+        if compression == 'RICE_1' and quantize_level == 0:
+            raise ValueError("err! RICE_1 can't store floats losslessly, use GZIP_1/GZIP_2 or opt into quantizing with quantize_level > 0")
+        self.dtype = dtype
+        self.compression = compression
+        self.quantize_level = quantize_level
+        self.tile_shape = tile_shape
+        self.bundle = bundle
+        self.keep_header = keep_header
+
+def prepare_array(data_array, settings):
+    """
+    downcast the derived map to the configured dtype
+
+    Args:
+        data_array (numpy array): map to be written
+        settings (OutputSettings): output configuration
+
+    Returns:
+        data_array (numpy array): the same map, as the configured dtype
+    """
+    data_array = np.asarray(data_array)
+    if settings.dtype is not None and data_array.dtype != np.dtype(settings.dtype):
+        data_array = data_array.astype(settings.dtype)
+    return data_array
+
+def make_image_hdu(data_array, header, settings, name=None, primary=False):
+    """
+    build the HDU for one derived map based on the output settings
+
+    Args:
+        data_array (numpy array): map to be written
+        header (fits header or None): header of the input file the map came from
+        settings (OutputSettings): output configuration
+        name (string or None): EXTNAME for the HDU, used when bundling
+        primary (bool): return a PrimaryHDU (only possible when not compressing)
+
+    Returns:
+        hdu: PrimaryHDU, ImageHDU or CompImageHDU holding the map
+    """
+    from astropy.io import fits
+    data_array = prepare_array(data_array, settings)
+    if header is not None and settings.keep_header:
+        header = header.copy()
+        # the input header describes the input data, let astropy redo the structural keywords for the new array
+        for keyword in ('BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'NAXIS3', 'EXTEND', 'BSCALE', 'BZERO'):
+            header.remove(keyword, ignore_missing=True, remove_all=True)
+    else:
+        header = None
+
+    if settings.compression is not None:
+        hdu = fits.CompImageHDU(data_array, header, name=name, compression_type=settings.compression,
+                                quantize_level=settings.quantize_level, tile_shape=settings.tile_shape)
+    elif primary:
+        hdu = fits.PrimaryHDU(data_array, header)
+    else:
+        hdu = fits.ImageHDU(data_array, header, name=name)
+    if name is not None:
+        hdu.header['MAPNAME'] = (name, 'map name as given, EXTNAME is upper-cased') # so read_bundle gives back the same keys for fits and npz
+    return hdu
+
+def write_map(data_array, header, output_path, settings=None):
+    """
+    write a single derived map to its own file, replaces the old fits.PrimaryHDU(...).writeto(...) pattern
+
+    Args:
+        data_array (numpy array): map to be written
+        header (fits header or None): header of the input file the map came from
+        output_path (string): complete path of the output .fits file
+        settings (OutputSettings or None): output configuration, None uses the defaults
+
+    Returns:
+        output_path (string): where the map went
+    """
+    from astropy.io import fits
+    settings = settings or OutputSettings()
+    if settings.compression is not None:
+        # compressed images can't live in the primary HDU, so it stays empty
+        hdulist = fits.HDUList([fits.PrimaryHDU(), make_image_hdu(data_array, header, settings)])
+    else:
+        hdulist = fits.HDUList([make_image_hdu(data_array, header, settings, primary=True)])
+    hdulist.writeto(output_path, overwrite=True)
+    return output_path
+
+class MapBundle:
+    """
+    collects many small maps from one sweep and writes them to one multi-extension FITS file or one NPZ archive
+    maps are kept in memory until close(), at 101x101 float32 that's ~40kB a map so a whole sweep fits easily
+
+    usage:
+        with MapBundle('sweep-std.fits', settings) as bundle:
+            bundle.add('R0.5-M10,000-std', std_array, header)
+
+    Args:
+        output_path (string): path of the bundled file, extension is fixed up to match the bundle format
+        settings (OutputSettings or None): output configuration, bundle='fits' is assumed when it is None
+    """
+    def __init__(self, output_path, settings=None):
+        settings = settings or OutputSettings(bundle='fits')
+        if settings.bundle is None:
+            raise ValueError("err! MapBundle needs settings.bundle to be 'fits' or 'npz'")
+        extension = '.npz' if settings.bundle == 'npz' else '.fits'
+        root, old_extension = os.path.splitext(output_path)
+        self.output_path = root + extension if old_extension in ('.fits', '.npz', '') else output_path + extension
+        self.settings = settings
+        self.names = []
+        self.maps = {}
+        self.headers = {}
+
+    def add(self, name, data_array, header=None):
+        """
+        add a map to the bundle, name becomes the EXTNAME (fits) or array key (npz)
+        """
+        if name in self.maps:
+            raise ValueError(f"err! {name} is already in the bundle")
+        self.names.append(name)
+        self.maps[name] = prepare_array(data_array, self.settings)
+        self.headers[name] = header
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        """
+        write everything collected so far, returns the path of the bundled file (None if the bundle was empty)
+        """
+        if not self.names:
+            return None
+        if self.settings.bundle == 'npz':
+            # headers don't survive npz, the names are the only metadata kept
+            save = np.savez_compressed if self.settings.compression is not None else np.savez
+            save(self.output_path, **self.maps)
+        else:
+            from astropy.io import fits
+            hdulist = fits.HDUList([fits.PrimaryHDU()])
+            for name in self.names:
+                hdulist.append(make_image_hdu(self.maps[name], self.headers[name], self.settings, name=name))
+            hdulist.writeto(self.output_path, overwrite=True)
+        return self.output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        return False
+
+def read_bundle(bundle_path):
+    """
+    read every map back out of a bundled file, for plotting
+
+    Args:
+        bundle_path (string): path of a .fits bundle or .npz archive written by MapBundle
+
+    Returns:
+        maps (dict): map name (as passed to MapBundle.add) -> numpy array, in the order they were written
+    """
+    if bundle_path.endswith('.npz'):
+        with np.load(bundle_path) as archive:
+            return {name: archive[name] for name in archive.files}
+    from astropy.io import fits
+    maps = {}
+    with fits.open(bundle_path) as hdulist:
+        for hdu in hdulist[1:]:
+            maps[hdu.header.get('MAPNAME', hdu.name)] = hdu.data
+    return maps
+
+def open_output(settings, bundle_path):
+    """
+    small helper for the folder loops: returns a MapBundle when bundling is on, otherwise None
+    """
+    if settings is not None and settings.bundle is not None:
+        return MapBundle(bundle_path, settings)
+    return None
+
+def save_map(data_array, header, output_path, settings=None, bundle=None):
+    """
+    write one map either straight to output_path or into the open bundle, this is what the folder loops call
+
+    Args:
+        data_array (numpy array): map to be written
+        header (fits header or None): header of the input file the map came from
+        output_path (string): where the map would go as its own file, its base name is the bundle key
+        settings (OutputSettings or None): output configuration
+        bundle (MapBundle or None): open bundle from open_output()
+
+    Returns:
+        output_path (string): path written, or the bundle path when bundling
+    """
+    if bundle is not None:
+        bundle.add(os.path.splitext(os.path.basename(output_path))[0], data_array, header)
+        return bundle.output_path
+    return write_map(data_array, header, output_path, settings)
+
+def multiscale_bundle(output_folder, base_filename, scales, std_maps, header=None, settings=None):
+    """
+    one bundle per input file holding its std maps for every (wavelength, aperture) scale, for the multiscale std runs.
+    close() it (or hand close to a BackgroundWriter) to write {base_filename}-std-multiscale.fits (.npz if settings.bundle is 'npz')
+
+    Args:
+        output_folder (string): where the bundle goes
+        base_filename (string): input file name without extension, map names are {base_filename}-std-{wavelength}um-{aperture}m
+                                so they stay unique across files and the next stage can expand the bundles side by side
+        scales (list of tuples): (wavelength [m], aperture [m], lambda/D [pixels]) for each map
+        std_maps (list of numpy arrays): one per scale, e.g. from local_noise.find_local_std_pyramid()
+        header (fits header or None): header of the input, None for npz inputs
+        settings (OutputSettings or None): output configuration, bundle='fits' unless it asks for 'npz'
+
+    Returns:
+        bundle (MapBundle): filled but not written yet
+    """
+    settings = copy.copy(settings) if settings is not None else OutputSettings()
+    settings.bundle = settings.bundle or 'fits' # one file holding all the radii is the whole point here
+    bundle = MapBundle(os.path.join(output_folder, f'{base_filename}-std-multiscale.fits'), settings)
+    for (wavelength, aperture, lambda_over_d), std_map in zip(scales, std_maps):
+        scale_header = None # headers don't survive npz anyway
+        if settings.bundle == 'fits':
+            from astropy.io import fits
+            scale_header = header.copy() if header is not None else fits.Header()
+            scale_header['WAVELEN'] = (wavelength, 'wavelength used for lambda/D [m]')
+            scale_header['APERTURE'] = (aperture, 'effective aperture used for lambda/D [m]')
+            scale_header['LAMBDAD'] = (lambda_over_d, 'std disk radius [pixels]')
+        bundle.add(f'{base_filename}-std-{wavelength * 1e6:g}um-{aperture:g}m', std_map, scale_header)
+    return bundle
+
+def read_map(file_path):
+    """
+    read a derived map back in no matter how it was written, compressed maps sit in the first extension
+    instead of the primary HDU so hdulist[0].data alone isn't enough anymore, and '<bundle file>/<map name>.fits'
+    paths from expand_bundles() read that one map out of the bundle
+
+    Args:
+        file_path (string): complete path to the map
+
+    Returns:
+        data_array: the map
+        header: header of the HDU the map came from (None for maps out of an npz bundle)
+    """
+    member = split_bundle_path(file_path)
+    if member is not None:
+        return read_bundle_map(*member)
+    from astropy.io import fits
+    with fits.open(file_path) as hdulist:
+        for hdu in hdulist:
+            if hdu.data is not None:
+                return hdu.data, hdu.header
+        return None, hdulist[0].header
+
+def bundle_map_names(file_path):
+    """
+    names of the maps in a bundle written by MapBundle, None if file_path is a plain map file
+    """
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as archive:
+            return list(archive.files)
+    from astropy.io import fits
+    with fits.open(file_path) as hdulist: # lazy, only the headers that get looked at are read
+        if hdulist[0].header.get('NAXIS', 0) != 0:
+            return None
+        try:
+            first = hdulist[1]
+        except IndexError:
+            return None
+        if 'MAPNAME' not in first.header:
+            return None # e.g. a single tile-compressed map
+        return [hdu.header.get('MAPNAME', hdu.name) for hdu in hdulist[1:]]
+
+def expand_bundles(file_paths):
+    """
+    plain map files stay as they are, every bundle becomes one '<bundle file>/<map name>.fits' path per map inside it,
+    so a loop over the result sees every map (not just the first extension) under its own name
+
+    Raises:
+        ValueError: two bundles hold maps with the same name, the outputs would overwrite each other
+    """
+    expanded = []
+    for file_path in file_paths:
+        names = bundle_map_names(file_path)
+        if names is None:
+            expanded.append(file_path)
+        else:
+            expanded.extend(os.path.join(file_path, f'{name}.fits') for name in names)
+    base_names = [os.path.basename(file_path) for file_path in expanded]
+    duplicates = sorted({name for name in base_names if base_names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"err! the same map name shows up more than once in these files/bundles: {duplicates}")
+    return expanded
+
+def split_bundle_path(file_path):
+    """
+    (bundle path, map name) for a path made by expand_bundles(), None for an ordinary file
+    """
+    bundle_path = os.path.dirname(file_path)
+    if os.path.isfile(bundle_path) and not os.path.exists(file_path):
+        return bundle_path, os.path.splitext(os.path.basename(file_path))[0]
+    return None
+
+def read_bundle_map(bundle_path, name):
+    """
+    one map (and its header, None for npz) out of a bundle
+    """
+    if bundle_path.endswith('.npz'):
+        with np.load(bundle_path) as archive:
+            return archive[name], None
+    from astropy.io import fits
+    with fits.open(bundle_path) as hdulist:
+        for hdu in hdulist[1:]:
+            if hdu.header.get('MAPNAME', hdu.name) == name:
+                return hdu.data, hdu.header
+    raise KeyError(f"err! no map called {name} in {bundle_path}")
@@ -0,0 +1,139 @@
+"""
+fits_tools.py
+
+Description: the little .fits utilities (stacking/dividing folders, trimming borders, checking dimensions) from
+division-of-two-folders-fits-contents.py, trim-fits-files-borders.py and get-array-dimensions-for-fits-file.py,
+as importable functions for the nircam-analysis command
+
+astropy is only imported inside the functions that need it, and the inventory reads the headers itself,
+so listing a folder doesn't pay for importing astropy or numpy at all
+"""
+import os
+
+FITS_BLOCK = 2880 # fits files are made of 2880 byte blocks, headers are 80 character cards
+CARD = 80
+
+def stack_fits_files(folder_path):
+    """
+    sum the primary data of every .fits file in folder_path
+
+    Returns:
+        stacked_data (numpy array or None): None if the folder has no usable .fits files
+    """
+    from astropy.io import fits
+    fits_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.fits'))
+    if not fits_files:
+        print(f"No .fits files found in the folder: {folder_path}")
+        return None
+    stacked_data = None
+    for file_name in fits_files:
+        print(f"Processing file: {file_name}")
+        with fits.open(os.path.join(folder_path, file_name)) as hdul:
+            try:
+                data = hdul[0].data
+                if data is None:
+                    print(f"Error: No data found in file: {file_name}")
+                    continue
+                print(f"Data shape: {data.shape}")
+                if stacked_data is None:
+                    stacked_data = data.astype(float) # copy, so the file's own array isn't modified by +=
+                else:
+                    stacked_data += data
+            except Exception as e:
+                print(f"Error reading file: {file_name}: {e}")
+    print(f"Number of .fits files found: {len(fits_files)}")
+    if stacked_data is not None:
+        print(f"Stacked data shape: {stacked_data.shape}")
+    return stacked_data
+
+def divide_stacks(fits_folder1, fits_folder2):
+    """
+    stack of the first folder divided by stack of the second, None if either folder couldn't be stacked
+    """
+    import numpy as np
+    stack1 = stack_fits_files(fits_folder1)
+    stack2 = stack_fits_files(fits_folder2)
+    if stack1 is None or stack2 is None:
+        print("Error: Unable to stack .fits files.")
+        return None
+    return np.divide(stack1, stack2)
+
+def trim_borders(data_array, top=0, bottom=0, left=0, right=0):
+    """
+    remove rows/columns from each side of the image (last two axes, so cubes work too)
+    """
+    rows, columns = data_array.shape[-2:]
+    return data_array[..., top:rows - bottom, left:columns - right]
+
+def remove_border_rows(input_fits_path, output_fits_path, top=0, bottom=0, left=0, right=0):
+    """
+    Remove a specified number of rows from each side of the image and save it.
+
+    Parameters:
+        input_fits_path (str): Path to the input FITS file.
+        output_fits_path (str): Path to the output FITS file.
+        top, bottom, left, right (int): rows/columns to remove from each side, default is 0
+    """
+    from astropy.io import fits
+    with fits.open(input_fits_path) as hdulist:
+        cropped_data = trim_borders(hdulist[0].data, top, bottom, left, right)
+        fits.writeto(output_fits_path, cropped_data, hdulist[0].header, overwrite=True)
+    return cropped_data.shape
+
+def read_header_cards(file, max_cards=100000):
+    """
+    read one header starting at the current position, returns {keyword: raw value string} or None at end of file
+    """
+    cards = {}
+    read_cards = 0
+    while read_cards < max_cards:
+        block = file.read(FITS_BLOCK)
+        if len(block) < FITS_BLOCK:
+            return None if not cards else cards
+        for start in range(0, FITS_BLOCK, CARD):
+            card = block[start:start + CARD].decode('ascii', errors='replace')
+            keyword = card[:8].strip()
+            read_cards += 1
+            if keyword == 'END':
+                return cards
+            if card[8:10] == '= ' and keyword not in cards:
+                cards[keyword] = card[10:].split('/')[0].strip().strip("'").strip()
+    raise ValueError("err! no END card, is this really a .fits file?")
+
+def fits_inventory(file_path):
+    """
+    shape/type of every HDU in a .fits file, read straight from the headers without loading any data
+
+    Returns:
+        hdus (list of dicts): name, xtension, bitpix, shape (numpy order: frames, rows, columns), compressed flag
+    """
+    hdus = []
+    with open(file_path, 'rb') as file:
+        while True:
+            cards = read_header_cards(file)
+            if cards is None:
+                break
+            naxis = int(cards.get('NAXIS', 0))
+            axes = [int(cards.get(f'NAXIS{i}', 0)) for i in range(1, naxis + 1)]
+            bitpix = int(cards.get('BITPIX', 8))
+            compressed = cards.get('ZIMAGE', '') == 'T'
+            if compressed:
+                shape = tuple(int(cards.get(f'ZNAXIS{i}', 0)) for i in range(int(cards.get('ZNAXIS', 0)), 0, -1))
+                data_bitpix = int(cards.get('ZBITPIX', bitpix))
+            else:
+                shape = tuple(reversed(axes))
+                data_bitpix = bitpix
+            hdus.append({'name': cards.get('EXTNAME', 'PRIMARY' if not hdus else ''), 'xtension': cards.get('XTENSION', 'PRIMARY'),
+                         'bitpix': data_bitpix, 'shape': shape, 'compressed': compressed})
+            # skip the data (plus the heap for binary tables) to get to the next header
+            data_bytes = 0
+            if naxis:
+                data_bytes = abs(bitpix) // 8 * int(cards.get('GCOUNT', 1)) * (int(cards.get('PCOUNT', 0)) + _product(axes))
+            file.seek((data_bytes + FITS_BLOCK - 1) // FITS_BLOCK * FITS_BLOCK, os.SEEK_CUR)
+    return hdus
+
+def _product(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
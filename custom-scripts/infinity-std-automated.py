@@ -8,14 +8,14 @@ check infinity-std.py for better (or just in general) documentation
 """
 from math import pi
 import numpy as np
-from astropy.io import fits
 import os
+from fits_output import OutputSettings, multiscale_bundle, open_output, read_map, save_map
+from local_noise import find_local_noise, find_local_std_pyramid
+from prefetch_io import BackgroundWriter, StageTimer, list_fits_files, prefetch_fits_files
 
 def fits_to_numpy_array(file_path):
-    with fits.open(file_path) as hdulist:
-        data_array = hdulist[0].data
-        header = hdulist[0].header
-    return data_array, header
+    data_array, header = read_map(file_path) # also finds tile-compressed maps
+    return np.array(data_array), header # off the memmap so the prefetch thread does the decoding
 
 def find_dimensions(data_array):
     frames, rows, columns = data_array.shape
@@ -40,26 +40,64 @@ def find_standard_deviation(data_array, lambda_over_d, rows, columns):
 
     return std_dev_array
 
-def process_fits_files(folder_path, output_folder, wavelength, aperture_in_meters):
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.fits'):
-            file_path = os.path.join(folder_path, filename)
-            base_filename = os.path.splitext(filename)[0]
-            data_array, header = fits_to_numpy_array(file_path)
-            frames, rows, columns = find_dimensions(data_array)
-            lambda_over_d = find_lambda_over_d(wavelength, aperture_in_meters)
-            std_dev_array = find_standard_deviation(data_array, lambda_over_d, rows, columns)
+def process_fits_files(folder_path, output_folder, wavelength, aperture_in_meters, output_settings=None, read_ahead=2, max_pending_writes=4, estimator='std'):
+    timer = StageTimer()
+    bundle = open_output(output_settings, os.path.join(output_folder, 'std-maps'))
+    lambda_over_d = find_lambda_over_d(wavelength, aperture_in_meters)
+    # next read_ahead files are decoded on background threads and the writes go to a writer thread, so the std math never waits on the disk
+    with BackgroundWriter(max_pending=max_pending_writes, timer=timer) as writer:
+        for file_path, data_array, header in prefetch_fits_files(list_fits_files(folder_path), read_ahead=read_ahead, timer=timer, loader=fits_to_numpy_array):
+            base_filename = os.path.splitext(os.path.basename(file_path))[0]
+            with timer.stage('compute'):
+                # sliding-window version of find_standard_deviation(), estimator='std' gives the same map (to rounding) much faster
+                std_dev_array = find_local_noise(data_array, lambda_over_d, estimator=estimator)
 
-            output_fits_path = os.path.join(output_folder, f'{base_filename}-std.fits')
-            std_dev_array_hdulist = fits.PrimaryHDU(std_dev_array, header)
-            std_dev_array_hdulist.writeto(output_fits_path, overwrite=True)
+            output_fits_path = os.path.join(output_folder, f'{base_filename}-{estimator.replace("_", "-")}.fits')
+            writer.submit(save_map, std_dev_array, header, output_fits_path, output_settings, bundle)
 
-            print(f"Finished calculating std for {output_fits_path}")
+            print(f"Finished calculating std for {output_fits_path if bundle is None else base_filename + ', goes into ' + bundle.output_path}")
+    if bundle is not None:
+        print(f"std maps bundled into {bundle.close()}")
+    timer.report()
+
+def process_fits_files_multiscale(folder_path, output_folder, wavelengths, apertures_in_meters, output_settings=None, read_ahead=2, max_pending_writes=4):
+    """
+    std maps for every (wavelength, aperture) combination in one pass per file, written as one multi-extension
+    {base_filename}-std-multiscale.fits per input (or .npz if output_settings.bundle is 'npz')
+    use this for other filters or a different Lyot stop diameter instead of re-running process_fits_files() once per radius
+
+    Args:
+        wavelengths (list of floats): wavelengths in meters
+        apertures_in_meters (list of floats): effective apertures in meters, every wavelength is paired with every aperture
+    """
+    timer = StageTimer()
+    scales = [(wavelength, aperture, find_lambda_over_d(wavelength, aperture)) for wavelength in wavelengths for aperture in apertures_in_meters]
+    with BackgroundWriter(max_pending=max_pending_writes, timer=timer) as writer:
+        for file_path, data_array, header in prefetch_fits_files(list_fits_files(folder_path), read_ahead=read_ahead, timer=timer, loader=fits_to_numpy_array):
+            base_filename = os.path.splitext(os.path.basename(file_path))[0]
+            with timer.stage('compute'):
+                std_maps = find_local_std_pyramid(data_array, [lambda_over_d for _, _, lambda_over_d in scales])
+
+            bundle = multiscale_bundle(output_folder, base_filename, scales, std_maps, header, output_settings)
+            writer.submit(bundle.close)
+
+            print(f"Finished calculating {len(scales)} std maps for {bundle.output_path}")
+    timer.report()
 
 # Example usage
 folder_path = '/'
 output_folder = ''
 wavelength = 4.5e-6  # example wavelength in meters
 aperture_in_meters = 5.2  # example aperture in meters, this is what we used for the paper
+output_settings = OutputSettings(dtype=None, compression=None, quantize_level=0, bundle=None) # lossless like before, check fits_output.py for float32 / compression / bundle='fits' or 'npz'
+
+read_ahead = 2 # how many files to decode ahead of the one being worked on
+estimator = 'std' # 'std' (plain nanstd), or the robust ones 'mad', 'sigma_clip', 'percentile', check local_noise.py
+# multi-scale mode, set these to lists (e.g. [3.56e-6, 4.44e-6] and [5.2, 6.5]) to get every combination's std map in one pass per file
+wavelengths = None
+apertures_in_meters = None
 
-process_fits_files(folder_path, output_folder, wavelength, aperture_in_meters)
+if wavelengths is not None or apertures_in_meters is not None:
+    process_fits_files_multiscale(folder_path, output_folder, wavelengths or [wavelength], apertures_in_meters or [aperture_in_meters], output_settings, read_ahead=read_ahead)
+else:
+    process_fits_files(folder_path, output_folder, wavelength, aperture_in_meters, output_settings, read_ahead=read_ahead, estimator=estimator)
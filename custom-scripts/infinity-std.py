@@ -14,8 +14,10 @@ and the added mask (lyot,pupil,bar) and have default hard-coded values based on
 #can import everything outside of __name__='__main__' brackets since not using pancake... 
 from math import pi
 import numpy as np
-from astropy.io import fits
 import os
+from fits_output import OutputSettings, open_output, read_map, save_map
+from local_noise import find_local_noise
+from prefetch_io import BackgroundWriter, StageTimer, list_fits_files, prefetch_fits_files
 
 def fits_to_numpy_array(file_path):
     """
@@ -28,9 +30,8 @@ def fits_to_numpy_array(file_path):
         data_array: the x and y values for the array, used later to calculate STD
         header: needed for when creating a new HDU later filled with the calculated std values
     """
-    with fits.open(file_path) as hdulist:
-        data_array=hdulist[0].data
-        header=hdulist[0].header
+    data_array, header = read_map(file_path) #read_map also finds tile-compressed maps, which sit in the first extension
+    data_array = np.array(data_array) #off the memmap, so the decoding happens on the prefetch thread (this is its loader)
     return data_array, header
 
 def find_dimensions(data_array):
@@ -92,7 +93,7 @@ def find_standard_deviation(data_array, lambda_over_d, rows, columns):
         std_array (numpy array): new numpy array of properly calculated STDs for each pixel in original .fits file, that can then be processed into a .fits file
     """
     std_array = np.zeros((rows, columns), dtype=data_array.dtype) # empty numpy array to store calculated std values in
-    x_coords, y_coords = np.meshgrid(np.arange(rows), np.arange(columns)) # create coordinate grids
+    x_coords, y_coords = np.meshgrid(np.arange(rows), np.arange(columns), indexing='ij') # create coordinate grids, 'ij' so the mask is (rows, columns) like the data
     for i in range(rows):
         #if i % 2 == 0: #for troubleshooting
             #print(f"Processing row {i} out of {rows}") #for troubleshooting
@@ -110,25 +111,35 @@ def find_standard_deviation(data_array, lambda_over_d, rows, columns):
 
 folder_path = '' #folder containing all of the RDI .fits files
 output_folder = '' #folder to store all of the STD .fits files
-# Iterate through each file in the folder
-for filename in os.listdir(folder_path):
-    if filename.endswith('.fits'):
-        file_path = os.path.join(folder_path, filename) #folder path and filename
-        base_filename = os.path.splitext(filename)[0] #extract just filename
+output_settings = OutputSettings(dtype=None, compression=None, quantize_level=0, bundle=None) # lossless like before, check fits_output.py for float32 / compression / bundle='fits' or 'npz'
+bundle = open_output(output_settings, os.path.join(output_folder, 'std-maps')) #None unless bundling all the STD maps into one file
+read_ahead = 2 #how many files get decoded on background threads ahead of the one being worked on, check prefetch_io.py
+estimator = 'std' #'std' is the plain np.nanstd below, 'mad', 'sigma_clip' or 'percentile' give robust noise maps (hot pixels, companion speckles), check local_noise.py
+timer = StageTimer() #keeps track of read/compute/write time so we can see where the time actually goes
+# Iterate through each file in the folder, the next files are read while this one is computed and the writes happen on a writer thread
+with BackgroundWriter(max_pending=4, timer=timer) as writer:
+    for file_path, data_array, header in prefetch_fits_files(list_fits_files(folder_path), read_ahead=read_ahead, timer=timer, loader=fits_to_numpy_array):
+        base_filename = os.path.splitext(os.path.basename(file_path))[0] #extract just filename
         
         # Perform the standard deviation calculation
-        data_array, header = fits_to_numpy_array(file_path)
-        frames, rows, columns = find_dimensions(data_array)
-        wavelength = 4.5e-6  # example wavelength in meters; this is what was used for our paper
-        aperture_in_meters = 5.2  # example aperture in meters; this was used for our paper
-        lambda_over_d = find_lambda_over_d(wavelength, aperture_in_meters)
-        std_array = find_standard_deviation(data_array, lambda_over_d, rows, columns)
+        with timer.stage('compute'):
+            frames, rows, columns = find_dimensions(data_array)
+            wavelength = 4.5e-6  # example wavelength in meters; this is what was used for our paper
+            aperture_in_meters = 5.2  # example aperture in meters; this was used for our paper
+            lambda_over_d = find_lambda_over_d(wavelength, aperture_in_meters)
+            if estimator == 'std':
+                std_array = find_standard_deviation(data_array, lambda_over_d, rows, columns)
+            else:
+                std_array = find_local_noise(data_array, lambda_over_d, estimator=estimator) # robust version, same disk footprint
         # Define the output path based on the base filename and the output folder
-        output_fits_path = os.path.join(output_folder, f'{base_filename}-std.fits')
+        output_fits_path = os.path.join(output_folder, f'{base_filename}-{estimator.replace("_", "-")}.fits') #-std.fits, -mad.fits, -sigma-clip.fits or -percentile.fits
         
-        # Save the standard deviation array to a new .fits file
-        std_array_hdulist = fits.PrimaryHDU(std_array, header)
-        std_array_hdulist.writeto(output_fits_path, overwrite=True)
+        # Save the standard deviation array to a new .fits file (or into the bundle), handed off to the writer thread
+        writer.submit(save_map, std_array, header, output_fits_path, output_settings, bundle)
         
         # Print a message indicating the completion of the calculation
-        print(f"Finished calculating std for {output_fits_path}")
+        print(f"Finished calculating std for {output_fits_path if bundle is None else base_filename + ', goes into ' + bundle.output_path}")
+
+if bundle is not None:
+    print(f"all STD maps bundled into {bundle.close()}")
+timer.report()
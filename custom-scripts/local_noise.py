@@ -0,0 +1,254 @@
+"""
+local_noise.py
+
+Description: local noise maps inside the lambda/D disk, plain np.nanstd plus robust estimators
+find_standard_deviation() in infinity-std.py builds a brand new distance mask for every single pixel which is slow, and plain std
+gets inflated by hot pixels and leftover companion speckles. here the disk footprint is built once and slid across the image
+(numpy sliding_window_view), so every pixel's neighbourhood comes out of one gather and each estimator is a single vectorized
+reduction over the last axis.
+
+estimators:
+    'std'         -- np.nanstd of the disk, same numbers as find_standard_deviation() in infinity-std.py / infinity-std-automated.py
+    'mad'         -- median absolute deviation, scaled by 1.4826 so it matches std for gaussian noise
+    'sigma_clip'  -- std after iteratively throwing out pixels more than clip_sigma away from the median
+    'percentile'  -- half the distance between the 15.87th and 84.13th percentiles (the +-1 sigma points of a gaussian)
+
+same footprint as infinity-std.py: all frames, every pixel with distance < lambda_over_d, pixels off the edge of the image just aren't counted
+
+find_local_std_pyramid() does plain std for several lambda/D radii at once (other filters, other Lyot stop diameters). the disk offsets
+are walked from the center outwards while running count/sum/sum-of-squares maps are accumulated, and every time the walk passes one of
+the radii that radius' std map is read straight off the running sums, so the biggest radius costs one pass and the smaller ones are free.
+"""
+import math
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+ESTIMATORS = ('std', 'mad', 'sigma_clip', 'percentile')
+MAD_TO_SIGMA = 1.4826 # 1 / Phi^-1(3/4), turns a MAD into a gaussian sigma
+
+def find_lambda_over_d(wavelength, aperture_in_meters, arcsec_per_pixel=0.063):
+    """
+    lambda/D in pixels, same as find_lambda_over_d() in infinity-std.py (check there for the worked example)
+
+    Args:
+        wavelength (float): in meters, 4.5e-6 for the paper
+        aperture_in_meters (float): effective aperture, 5.2 for NIRCam coronagraphy with the Lyot stop
+        arcsec_per_pixel (float): NIRCam long wavelength pixel scale
+
+    Returns:
+        lambda_over_d (float): disk radius in pixels
+    """
+    return ((wavelength / aperture_in_meters) * (180 / math.pi) * 3600) / arcsec_per_pixel
+
+def disk_footprint(lambda_over_d):
+    """
+    the circular footprint used for every pixel, built once
+
+    Args:
+        lambda_over_d (float): radius of the disk in pixels, from find_lambda_over_d()
+
+    Returns:
+        footprint (numpy bool array): (2*half_width+1) x (2*half_width+1) window, True inside the disk
+        half_width (int): how far the window reaches from its center pixel
+    """
+    half_width = max(int(math.ceil(lambda_over_d)) - 1, 0)
+    # anything at distance >= lambda_over_d is out anyway, so the window never needs to reach ceil(lambda_over_d)
+    offsets = np.arange(-half_width, half_width + 1)
+    dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+    footprint = np.sqrt(dy**2 + dx**2) < lambda_over_d
+    return footprint, half_width
+
+def gather_local_samples(data_array, footprint, half_width, row_start, row_stop):
+    """
+    every pixel's disk neighbourhood for a band of rows, in one gather
+
+    Args:
+        data_array (numpy array): frames x rows x columns, NaN padded already by find_local_noise()
+        footprint, half_width: from disk_footprint()
+        row_start, row_stop (int): band of output rows to gather
+
+    Returns:
+        samples (numpy array): (row_stop-row_start) x columns x (frames * pixels in the disk)
+    """
+    band = data_array[:, row_start:row_stop + 2 * half_width, :]
+    width = 2 * half_width + 1
+    windows = sliding_window_view(band, (width, width), axis=(1, 2)) # frames x rows x columns x width x width, no copy yet
+    samples = windows[..., footprint] # frames x rows x columns x pixels in disk, this is the only copy
+    frames, rows, columns, pixels = samples.shape
+    return np.moveaxis(samples, 0, 2).reshape(rows, columns, frames * pixels)
+
+def nan_quantiles(samples, quantiles):
+    """
+    quantiles of the last axis ignoring NaNs, same linear interpolation as np.nanpercentile
+    np.nanmedian/np.nanpercentile fall back to a python loop over every pixel when there are NaNs (always, with the padded border),
+    one sort of the whole block is much faster. NaNs sort to the end so each pixel just interpolates inside its own valid count
+
+    Args:
+        samples (numpy array): anything x pixels
+        quantiles (list of floats): between 0 and 1
+
+    Returns:
+        values (list of numpy arrays): one samples.shape[:-1] array per quantile, NaN where there was nothing valid
+    """
+    ordered = np.sort(samples, axis=-1)
+    valid = np.count_nonzero(~np.isnan(ordered), axis=-1)
+    last = np.maximum(valid - 1, 0)
+    values = []
+    for quantile in quantiles:
+        position = quantile * last
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        low_value = np.take_along_axis(ordered, lower[..., np.newaxis], axis=-1)[..., 0]
+        high_value = np.take_along_axis(ordered, upper[..., np.newaxis], axis=-1)[..., 0]
+        value = low_value + fraction * (high_value - low_value)
+        value[valid == 0] = np.nan
+        values.append(value)
+    return values
+
+def robust_sigma(samples, estimator='std', clip_sigma=3.0, clip_iterations=5, percentiles=(15.87, 84.13)):
+    """
+    reduce the last axis of samples to one noise value, ignoring NaNs
+
+    Args:
+        samples (numpy array): anything x pixels
+        estimator (string): one of ESTIMATORS
+        clip_sigma (float): clipping threshold for 'sigma_clip', in sigma
+        clip_iterations (int): max number of clipping passes for 'sigma_clip'
+        percentiles (tuple): lower and upper percentile for 'percentile'
+
+    Returns:
+        sigma (numpy array): samples.shape[:-1]
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # all-NaN neighbourhoods just come out as NaN
+        if estimator == 'std':
+            return np.nanstd(samples, axis=-1)
+        if estimator == 'mad':
+            median, = nan_quantiles(samples, [0.5])
+            deviation, = nan_quantiles(np.abs(samples - median[..., np.newaxis]), [0.5])
+            return MAD_TO_SIGMA * deviation
+        if estimator == 'percentile':
+            low, high = nan_quantiles(samples, [percentiles[0] / 100, percentiles[1] / 100])
+            return (high - low) / 2
+        if estimator == 'sigma_clip':
+            samples = np.array(samples, dtype=float) # clipped pixels get set to NaN, so work on a copy
+            for _ in range(clip_iterations):
+                median, = nan_quantiles(samples, [0.5])
+                std = np.nanstd(samples, axis=-1)
+                outliers = np.abs(samples - median[..., np.newaxis]) > clip_sigma * std[..., np.newaxis]
+                if not outliers.any():
+                    break
+                samples[outliers] = np.nan
+            return np.nanstd(samples, axis=-1)
+    raise ValueError(f"err! estimator must be one of {ESTIMATORS}, got {estimator}")
+
+def as_frames(data_array):
+    """
+    frames x rows x columns view of the data plus the dtype the output map should have
+    """
+    data_array = np.asarray(data_array)
+    if data_array.ndim == 2:
+        data_array = data_array[np.newaxis]
+    elif data_array.ndim != 3:
+        raise ValueError("err! wrong dimensions.")
+    output_dtype = data_array.dtype if np.issubdtype(data_array.dtype, np.floating) else np.float64
+    return data_array, output_dtype
+
+def find_local_noise(data_array, lambda_over_d, estimator='std', rows_per_chunk=32, **estimator_kwargs):
+    """
+    noise map for every pixel in the .fits data using the lambda/D disk, drop-in for find_standard_deviation()
+
+    Args:
+        data_array (numpy array): frames x rows x columns (a single rows x columns image also works)
+        lambda_over_d (float): radius of the disk in pixels, from find_lambda_over_d()
+        estimator (string): 'std', 'mad', 'sigma_clip' or 'percentile'
+        rows_per_chunk (int): rows gathered at once, keeps memory to rows_per_chunk x columns x frames x disk pixels
+        **estimator_kwargs: clip_sigma / clip_iterations / percentiles, passed on to robust_sigma()
+
+    Returns:
+        noise_array (numpy array): rows x columns map with the same dtype as the input
+    """
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"err! estimator must be one of {ESTIMATORS}, got {estimator}")
+    if estimator == 'std':
+        # plain std only needs sums, the single-radius pyramid gets it without gathering the neighbourhoods
+        return find_local_std_pyramid(data_array, [lambda_over_d])[0]
+    data_array, output_dtype = as_frames(data_array)
+    frames, rows, columns = data_array.shape
+
+    footprint, half_width = disk_footprint(lambda_over_d)
+    # NaN border so the windows at the edges only count pixels that are actually on the image, nan-reductions skip the rest
+    padded = np.pad(data_array.astype(np.float64), ((0, 0), (half_width, half_width), (half_width, half_width)), constant_values=np.nan)
+
+    noise_array = np.empty((rows, columns), dtype=output_dtype)
+    for row_start in range(0, rows, rows_per_chunk):
+        row_stop = min(row_start + rows_per_chunk, rows)
+        samples = gather_local_samples(padded, footprint, half_width, row_start, row_stop)
+        noise_array[row_start:row_stop] = robust_sigma(samples, estimator, **estimator_kwargs)
+    return noise_array
+
+def find_local_std_pyramid(data_array, lambda_over_d_values):
+    """
+    plain local std maps (np.nanstd inside the disk) for several lambda/D radii in one pass over the data
+
+    Args:
+        data_array (numpy array): frames x rows x columns (a single rows x columns image also works)
+        lambda_over_d_values (list of floats): disk radii in pixels, from find_lambda_over_d() for each wavelength/aperture
+
+    Returns:
+        std_maps (list of numpy arrays): one rows x columns map per radius, in the same order as lambda_over_d_values
+    """
+    data_array, output_dtype = as_frames(data_array)
+    frames, rows, columns = data_array.shape
+    radii = sorted(set(float(value) for value in lambda_over_d_values))
+    footprint, half_width = disk_footprint(radii[-1])
+
+    # NaN border like find_local_noise(); subtracting the global mean first keeps sum-of-squares from losing precision
+    data_array = data_array.astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        offset = np.nanmean(data_array)
+    if np.isfinite(offset):
+        data_array = data_array - offset
+    padded = np.pad(data_array, ((0, 0), (half_width, half_width), (half_width, half_width)), constant_values=np.nan)
+    valid = ~np.isnan(padded)
+    # summing over frames first means each offset is a rows x columns add instead of frames x rows x columns
+    counts = valid.sum(axis=0, dtype=np.float64)
+    sums = np.where(valid, padded, 0.0).sum(axis=0)
+    squares = np.where(valid, padded**2, 0.0).sum(axis=0)
+
+    dy, dx = np.nonzero(footprint)
+    dy, dx = dy - half_width, dx - half_width
+    distances = np.sqrt(dy**2 + dx**2)
+    order = np.argsort(distances, kind='stable')
+
+    running_count = np.zeros((rows, columns))
+    running_sum = np.zeros((rows, columns))
+    running_squares = np.zeros((rows, columns))
+    std_by_radius = {}
+    radius_index = 0
+    for k in order:
+        # every radius smaller than (or equal to) this offset's distance is complete, read it off the running sums
+        while radius_index < len(radii) and distances[k] >= radii[radius_index]:
+            std_by_radius[radii[radius_index]] = std_from_sums(running_count, running_sum, running_squares, output_dtype)
+            radius_index += 1
+        window = (slice(half_width + dy[k], half_width + dy[k] + rows), slice(half_width + dx[k], half_width + dx[k] + columns))
+        running_count += counts[window]
+        running_sum += sums[window]
+        running_squares += squares[window]
+    for radius in radii[radius_index:]:
+        std_by_radius[radius] = std_from_sums(running_count, running_sum, running_squares, output_dtype)
+    return [std_by_radius[float(value)] for value in lambda_over_d_values]
+
+def std_from_sums(count, total, squares, output_dtype):
+    """
+    population std (ddof=0, same as np.nanstd) from count / sum / sum of squares maps, NaN where nothing was counted
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = np.maximum(squares / count - mean**2, 0.0)
+    std = np.sqrt(variance)
+    std[count == 0] = np.nan
+    return std.astype(output_dtype)
@@ -8,8 +8,9 @@ check infinity-std.py for better (or just in general) documentation
 note: 'STD(s)' is my lingo for standard deviation calculation
 """
 import os
-import numpy as np
-from astropy.io import fits
+from fits_output import OutputSettings, open_output, read_map, save_map
+from prefetch_io import BackgroundWriter, StageTimer, list_fits_files, prefetch_fits_files
+from sensitivity_loss import array_operations, read_calibration, sensitivity_loss
 
 def fits_to_numpy_array(file_path):
     """convert inputed .fits file to a workable format
@@ -21,50 +22,53 @@ def fits_to_numpy_array(file_path):
         data_array: the x and y values for our array, used to calculate standard deviation
         header: needed for when we create a new HDU later filled with the calculated std values
     """
-    with fits.open(file_path) as hdulist:
-        data_array = hdulist[0].data
-        header = hdulist[0].header # need the header for when we create a new HDU later with computed STDs
+    data_array, header = read_map(file_path) # STD maps may be tile-compressed, read_map finds whichever HDU has the data
     return data_array, header
 
 #science parameters
 sigma_contrast = 5 # in sigma units
-stellar_flux = 68747.44677595097 # taken from analysis.py in line 324 where i print the value of variable offaxis_peak_flux
-
-def array_operations(data_array, sigma_contrast, stellar_flux):
-    # empty numpy array to store calculated std values in
-    sigmaed_array = data_array * sigma_contrast # multiplied by 5
-    fluxed_array = sigmaed_array / stellar_flux # divided by peak stellar offaxis flux
-    magnitude_sensitive_array = -2.5 * np.log10(fluxed_array) # now make it magnitude units
-    return magnitude_sensitive_array
+calibration_table_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'pancake-simulations', 'calibration-table.json') # seeded with the paper's numbers, check stellar_calibration.py
+# peak stellar off-axis flux for this host/filter/mask, the table has the value from pancake's analysis.py offaxis_peak_flux that used to be hard-coded here (68747.44677595097)
+stellar_flux = read_calibration(calibration_table_path, 'HIP 65426', 'F444W', 'MASK335R')['offaxis_peak_flux']
 
 folder_path = ''
 ci_output_folder = ''
 sl_output_folder = ''
+output_settings = OutputSettings(dtype=None, compression=None, quantize_level=0, bundle=None) # lossless like before, check fits_output.py for float32 / compression / bundle='fits' or 'npz'
+ci_bundle = open_output(output_settings, os.path.join(ci_output_folder, 'CI-maps'))
+sl_bundle = open_output(output_settings, os.path.join(sl_output_folder, 'MSL-control-20-maps'))
+
+STD_of_control = ''
+read_ahead = 2 # how many STD maps get decoded ahead of the one being worked on, check prefetch_io.py
+timer = StageTimer()
+
+# the control STD is the same for every file so it only gets read and converted once
+data_array_of_control, header_of_control = fits_to_numpy_array(STD_of_control)
+post_operations_control_STD = array_operations(data_array_of_control, sigma_contrast, stellar_flux)
 
-for filename in os.listdir(folder_path):
-    if filename.endswith('.fits'):
-        file_path = os.path.join(folder_path, filename)
-        base_filename = os.path.splitext(filename)[0] #filename extraction
+with BackgroundWriter(max_pending=4, timer=timer) as writer:
+    for file_path, data_array_of_interest, header_of_interest in prefetch_fits_files(list_fits_files(folder_path), read_ahead=read_ahead, timer=timer):
+        base_filename = os.path.splitext(os.path.basename(file_path))[0] #filename extraction
         
         # Perform the array operations on the current file
-        data_array_of_interest, header_of_interest = fits_to_numpy_array(file_path)
-        STD_of_control = ''
-        data_array_of_control, header_of_control = fits_to_numpy_array(STD_of_control)
-        post_operations_STD_of_interest = array_operations(data_array_of_interest, sigma_contrast, stellar_flux)
-        post_operations_control_STD= array_operations(data_array_of_control,sigma_contrast, stellar_flux)
-        
-        # Calculate the sensitivity loss
-        sensitivity_loss = np.array(post_operations_control_STD) - np.array(post_operations_STD_of_interest)
+        with timer.stage('compute'):
+            post_operations_STD_of_interest = array_operations(data_array_of_interest, sigma_contrast, stellar_flux)
+            
+            # Calculate the sensitivity loss
+            sensitivity_loss_array = sensitivity_loss(post_operations_control_STD, post_operations_STD_of_interest)
 
         ci_output_path = os.path.join(ci_output_folder, f'{base_filename}-CI.fits')
         sl_output_path = os.path.join(sl_output_folder, f'{base_filename}-MSL-control-20.fits')
         
-        # Save post-standard deviation operations array to a new .fits file
-        contrast_image = fits.PrimaryHDU(post_operations_STD_of_interest, header_of_interest)
-        contrast_image.writeto(ci_output_path, overwrite=True)
+        # Save post-standard deviation operations array to a new .fits file, the writer thread does the actual writing
+        writer.submit(save_map, post_operations_STD_of_interest, header_of_interest, ci_output_path, output_settings, ci_bundle)
         print(f"done computing CI for {base_filename}")
         
         # Save the sensitivity loss to a new .fits file
-        sensitivity_loss_image = fits.PrimaryHDU(sensitivity_loss, header_of_interest)
-        sensitivity_loss_image.writeto(sl_output_path, overwrite=True)
+        writer.submit(save_map, sensitivity_loss_array, header_of_interest, sl_output_path, output_settings, sl_bundle)
         print(f"done computing SL for {base_filename}")
+
+if ci_bundle is not None:
+    print(f"CI maps bundled into {ci_bundle.close()}")
+    print(f"SL maps bundled into {sl_bundle.close()}")
+timer.report()
@@ -0,0 +1,237 @@
+"""
+nircam_analysis.py
+
+Description: one command for the analysis tools instead of editing empty paths at the bottom of every script
+
+    nircam-analysis std RDI-folder/ -o std-folder/                        (infinity-std.py)
+    nircam-analysis std RDI-folder/ -o std-folder/ --wavelength 3.56 4.44 --aperture 5.2 6.5   (multi-scale, one file per input)
+    nircam-analysis contrast std-folder/ -o CI-folder/ --calibration-table calibration-table.json
+    nircam-analysis sensitivity-loss std-folder/ --control control-std.fits -o MSL-folder/ --stellar-flux 68747.45
+    nircam-analysis stack folder-one/ folder-two/ -o one-divided-by-two.fits    (division-of-two-folders-fits-contents.py)
+    nircam-analysis trim in.fits out.fits --top 10 --bottom 5                  (trim-fits-files-borders.py)
+    nircam-analysis inventory some-folder/                                     (get-array-dimensions-for-fits-file.py)
+
+install with `pip install .` from the top of the repository, or run `python nircam_analysis.py ...` from this folder.
+numpy/astropy only get imported once a subcommand actually needs them, so --help and inventory start right away.
+the run_* functions take the parsed arguments, and main() takes an argument list, so batch drivers can call them in-process:
+    from nircam_analysis import main
+    main(['std', 'RDI-folder/', '-o', 'std-folder/', '--estimator', 'mad'])
+"""
+import argparse
+import os
+import sys
+
+def expand_inputs(paths, suffix='.fits', expand=True):
+    """
+    files stay files, folders become every .fits file inside them (same selection the scripts always used),
+    and with expand bundles (--bundle fits/npz output) become one entry per map inside them
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith((suffix, '.npz'))))
+        else:
+            files.append(path)
+    if not expand:
+        return files
+    from fits_output import expand_bundles
+    return expand_bundles(files)
+
+def add_output_arguments(parser):
+    group = parser.add_argument_group('output format (check fits_output.py)')
+    group.add_argument('--dtype', default='none', help="dtype written to disk, e.g. float32, 'none' keeps whatever the math produced (default)")
+    group.add_argument('--compression', choices=['none', 'RICE_1', 'GZIP_1', 'GZIP_2'], default='none', help='tile compression (default none)')
+    group.add_argument('--quantize-level', type=float, default=0.0, help='quantization levels per sigma for compressed floats, 0 = lossless GZIP (default), >0 is lossy')
+    group.add_argument('--bundle', choices=['none', 'fits', 'npz'], default='none', help='write all maps into one multi-extension file / npz archive')
+
+def output_settings(args):
+    from fits_output import OutputSettings
+    return OutputSettings(dtype=None if args.dtype == 'none' else args.dtype,
+                          compression=None if args.compression == 'none' else args.compression,
+                          quantize_level=args.quantize_level,
+                          bundle=None if args.bundle == 'none' else args.bundle)
+
+def add_flux_arguments(parser):
+    group = parser.add_argument_group('stellar flux (give --stellar-flux, or a calibration table entry)')
+    group.add_argument('--stellar-flux', type=float, help='peak stellar off-axis flux')
+    group.add_argument('--calibration-table', help='json table from pancake-simulations/stellar_calibration.py')
+    group.add_argument('--source', default='HIP 65426')
+    group.add_argument('--filter', default='F444W')
+    group.add_argument('--mask', default='MASK335R')
+    group.add_argument('--allow-measured-flux', action='store_true', help="accept an entry that only has the simulated offaxis_peak_flux_measured, not pancake's number")
+    parser.add_argument('--sigma', type=float, default=5.0, help='detection threshold in sigma (default 5)')
+
+def stellar_flux(args):
+    if args.stellar_flux is not None:
+        return args.stellar_flux
+    if args.calibration_table is None:
+        sys.exit("err! give --stellar-flux or --calibration-table")
+    from sensitivity_loss import read_calibration, stellar_flux_from
+    entry = read_calibration(args.calibration_table, args.source, args.filter, args.mask, allow_measured=args.allow_measured_flux)
+    return stellar_flux_from(entry, allow_measured=args.allow_measured_flux)
+
+def run_std(args):
+    from fits_output import multiscale_bundle, open_output, save_map
+    from local_noise import find_lambda_over_d, find_local_noise, find_local_std_pyramid
+    from prefetch_io import BackgroundWriter, StageTimer, prefetch_fits_files
+    settings = output_settings(args)
+    timer = StageTimer()
+    scales = [(wavelength * 1e-6, aperture, find_lambda_over_d(wavelength * 1e-6, aperture, args.pixel_scale))
+              for wavelength in args.wavelength for aperture in args.aperture]
+    multiscale = len(scales) > 1
+    if multiscale and args.estimator != 'std':
+        sys.exit("err! several wavelengths/apertures only works with --estimator std")
+    os.makedirs(args.output_folder, exist_ok=True)
+    bundle = None if multiscale else open_output(settings, os.path.join(args.output_folder, f'{args.estimator.replace("_", "-")}-maps'))
+    with BackgroundWriter(timer=timer) as writer:
+        for file_path, data_array, header in prefetch_fits_files(expand_inputs(args.inputs), read_ahead=args.read_ahead, timer=timer):
+            base_filename = os.path.splitext(os.path.basename(file_path))[0]
+            if multiscale:
+                with timer.stage('compute'):
+                    std_maps = find_local_std_pyramid(data_array, [lambda_over_d for _, _, lambda_over_d in scales])
+                file_bundle = multiscale_bundle(args.output_folder, base_filename, scales, std_maps, header, settings)
+                writer.submit(file_bundle.close)
+                print(f"{len(scales)} std maps for {file_bundle.output_path}")
+            else:
+                with timer.stage('compute'):
+                    noise_map = find_local_noise(data_array, scales[0][2], estimator=args.estimator)
+                output_path = os.path.join(args.output_folder, f'{base_filename}-{args.estimator.replace("_", "-")}.fits')
+                writer.submit(save_map, noise_map, header, output_path, settings, bundle)
+                print(f"Finished calculating {args.estimator} for {output_path if bundle is None else base_filename + ', goes into ' + bundle.output_path}")
+    if bundle is not None:
+        print(f"maps bundled into {bundle.close()}")
+    timer.report()
+
+def run_contrast(args):
+    from fits_output import open_output, save_map
+    from prefetch_io import BackgroundWriter, StageTimer, prefetch_fits_files
+    from sensitivity_loss import array_operations
+    settings = output_settings(args)
+    flux = stellar_flux(args)
+    timer = StageTimer()
+    os.makedirs(args.output_folder, exist_ok=True)
+    bundle = open_output(settings, os.path.join(args.output_folder, 'CI-maps'))
+    with BackgroundWriter(timer=timer) as writer:
+        for file_path, data_array, header in prefetch_fits_files(expand_inputs(args.inputs), read_ahead=args.read_ahead, timer=timer):
+            base_filename = os.path.splitext(os.path.basename(file_path))[0]
+            with timer.stage('compute'):
+                contrast_image = array_operations(data_array, args.sigma, flux)
+            writer.submit(save_map, contrast_image, header, os.path.join(args.output_folder, f'{base_filename}-CI.fits'), settings, bundle)
+            print(f"done computing CI for {base_filename}")
+    if bundle is not None:
+        print(f"CI maps bundled into {bundle.close()}")
+    timer.report()
+
+def run_sensitivity_loss(args):
+    from fits_output import open_output, read_map, save_map
+    from prefetch_io import BackgroundWriter, StageTimer, prefetch_fits_files
+    from sensitivity_loss import array_operations, find_local_loss, find_max_loss, sensitivity_loss
+    settings = output_settings(args)
+    flux = stellar_flux(args)
+    timer = StageTimer()
+    os.makedirs(args.output_folder, exist_ok=True)
+    control_std, _ = read_map(args.control)
+    post_operations_control_STD = array_operations(control_std, args.sigma, flux) # same for every file, done once
+    bundle = open_output(settings, os.path.join(args.output_folder, f'MSL-{args.suffix}-maps'))
+    with BackgroundWriter(timer=timer) as writer:
+        for file_path, data_array, header in prefetch_fits_files(expand_inputs(args.inputs), read_ahead=args.read_ahead, timer=timer):
+            base_filename = os.path.splitext(os.path.basename(file_path))[0]
+            with timer.stage('compute'):
+                loss = sensitivity_loss(post_operations_control_STD, array_operations(data_array, args.sigma, flux))
+                summary = f"total loss {find_max_loss(loss):.2f}"
+                if args.companion_xy is not None:
+                    summary += f", local loss {find_local_loss(loss, *args.companion_xy):.2f}"
+            writer.submit(save_map, loss, header, os.path.join(args.output_folder, f'{base_filename}-MSL-{args.suffix}.fits'), settings, bundle)
+            print(f"{base_filename}: {summary}")
+    if bundle is not None:
+        print(f"MSL maps bundled into {bundle.close()}")
+    timer.report()
+
+def run_stack(args):
+    from fits_output import write_map
+    from fits_tools import divide_stacks, stack_fits_files
+    if args.divide_by is None:
+        result = stack_fits_files(args.folder)
+    else:
+        result = divide_stacks(args.folder, args.divide_by)
+    if result is None:
+        sys.exit("err! nothing to stack")
+    write_map(result, None, args.output, output_settings(args))
+    print(f"result saved to {args.output}")
+
+def run_trim(args):
+    from fits_tools import remove_border_rows
+    shape = remove_border_rows(args.input, args.output, args.top, args.bottom, args.left, args.right)
+    print(f"trimmed to {shape}, saved to {args.output}")
+
+def run_inventory(args):
+    from fits_tools import fits_inventory
+    for file_path in expand_inputs(args.inputs, expand=False): # the inventory lists the bundle itself
+        print(file_path)
+        for index, hdu in enumerate(fits_inventory(file_path)):
+            shape = ' x '.join(str(axis) for axis in hdu['shape']) or 'no data'
+            compressed = ', tile compressed' if hdu['compressed'] else ''
+            print(f"  [{index}] {hdu['name'] or hdu['xtension']:<20} {shape:<18} BITPIX={hdu['bitpix']}{compressed}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nircam-analysis', description='analysis tools for the off-axis source NIRCam coronagraphy simulations')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    std = subparsers.add_parser('std', help='local noise maps inside the lambda/D disk (infinity-std.py)')
+    std.add_argument('inputs', nargs='+', help='RDI subtraction .fits files or folders of them')
+    std.add_argument('-o', '--output-folder', required=True)
+    std.add_argument('--wavelength', type=float, nargs='+', default=[4.5], help='wavelength(s) in microns (default 4.5)')
+    std.add_argument('--aperture', type=float, nargs='+', default=[5.2], help='effective aperture(s) in meters (default 5.2)')
+    std.add_argument('--pixel-scale', type=float, default=0.063, help='arcseconds per pixel (default 0.063)')
+    std.add_argument('--estimator', choices=['std', 'mad', 'sigma_clip', 'percentile'], default='std')
+    std.add_argument('--read-ahead', type=int, default=2, help='files decoded ahead on background threads')
+    add_output_arguments(std)
+    std.set_defaults(function=run_std)
+
+    contrast = subparsers.add_parser('contrast', help='contrast images (CI) in magnitudes from STD maps')
+    contrast.add_argument('inputs', nargs='+', help='STD maps or folders of them')
+    contrast.add_argument('-o', '--output-folder', required=True)
+    contrast.add_argument('--read-ahead', type=int, default=2)
+    add_flux_arguments(contrast)
+    add_output_arguments(contrast)
+    contrast.set_defaults(function=run_contrast)
+
+    loss = subparsers.add_parser('sensitivity-loss', help='magnitude sensitivity loss (MSL) maps against a control STD map')
+    loss.add_argument('inputs', nargs='+', help='STD maps or folders of them')
+    loss.add_argument('--control', required=True, help='STD map of the control scenario')
+    loss.add_argument('-o', '--output-folder', required=True)
+    loss.add_argument('--suffix', default='control-20', help="output name suffix, -MSL-<suffix>.fits (default control-20)")
+    loss.add_argument('--companion-xy', type=float, nargs=2, metavar=('X', 'Y'), help='also report the local loss within 1" of this pixel')
+    loss.add_argument('--read-ahead', type=int, default=2)
+    add_flux_arguments(loss)
+    add_output_arguments(loss)
+    loss.set_defaults(function=run_sensitivity_loss)
+
+    stack = subparsers.add_parser('stack', help='stack a folder of .fits files, optionally divided by the stack of a second folder')
+    stack.add_argument('folder')
+    stack.add_argument('divide_by', nargs='?', help='second folder, the result is stack(folder) / stack(divide_by)')
+    stack.add_argument('-o', '--output', required=True)
+    add_output_arguments(stack)
+    stack.set_defaults(function=run_stack)
+
+    trim = subparsers.add_parser('trim', help='trim rows/columns off the borders of a .fits image')
+    trim.add_argument('input')
+    trim.add_argument('output')
+    for side in ('top', 'bottom', 'left', 'right'):
+        trim.add_argument(f'--{side}', type=int, default=0)
+    trim.set_defaults(function=run_trim)
+
+    inventory = subparsers.add_parser('inventory', help='HDUs and array dimensions of .fits files, without loading the data')
+    inventory.add_argument('inputs', nargs='+', help='.fits files or folders of them')
+    inventory.set_defaults(function=run_inventory)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'compression', None) == 'RICE_1' and args.quantize_level == 0:
+        parser.error("--compression RICE_1 quantizes floats, give --quantize-level > 0 (lossy) or use GZIP_1/GZIP_2 for lossless")
+    return args.function(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+prefetch_io.py
+
+Description: overlapped I/O for the analysis folder loops
+the loops used to go read file -> compute -> write -> next file, so the disk sat idle while numpy worked and numpy sat idle
+while the disk worked. this file has the two pieces used to overlap them:
+1. prefetch_fits_files() -- generator that decodes the next read_ahead .fits files on background threads while you compute on the current one
+2. BackgroundWriter -- a single writer thread fed through a bounded queue, so writes happen behind the compute and memory can't run away
+StageTimer keeps track of how long each stage took so the loops can print per-stage throughput at the end
+
+numpy and astropy both release the GIL for the heavy lifting (decompression, file reads, big array math) so threads are enough here
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from fits_output import expand_bundles, read_map
+
+class StageTimer:
+    """
+    accumulates wall time and item counts per stage ('read', 'compute', 'write', ...), safe to use from several threads
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, stage, seconds, count=1):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + count
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def report(self):
+        """
+        print the per-stage totals and throughput, 'waiting' stages are time the compute loop spent blocked on I/O
+        """
+        elapsed = time.perf_counter() - self._start
+        print(f"---- I/O report ({elapsed:.2f} s wall) ----")
+        for stage in sorted(self.seconds):
+            seconds = self.seconds[stage]
+            count = self.counts[stage]
+            rate = count / seconds if seconds > 0 else float('inf')
+            print(f"{stage:>14}: {count} items, {seconds:.2f} s total, {rate:.2f} items/s")
+
+def load_fits_file(file_path):
+    """
+    read and fully decode one .fits file, np.array forces the data off the memmap so the work really happens on the background thread
+
+    Args:
+        file_path (string): complete path to the file
+
+    Returns:
+        data_array, header: same as fits_to_numpy_array() in the other scripts (the default loader)
+    """
+    data_array, header = read_map(file_path)
+    if data_array is not None:
+        data_array = np.array(data_array)
+    return data_array, header
+
+def prefetch_fits_files(file_paths, read_ahead=2, timer=None, loader=load_fits_file):
+    """
+    yields (file_path, data_array, header) for every path, in order, while the next read_ahead files are already being read
+
+    Args:
+        file_paths (list of strings): files to read, in the order you want them back
+        read_ahead (int): how many files to decode ahead of the one being worked on, 0 falls back to plain sequential reads
+        timer (StageTimer or None): records 'read' time (on the reader threads) and 'read wait' time (compute loop blocked)
+        loader (function): file_path -> (data_array, header), load_fits_file by default
+
+    example usage:
+        for file_path, data_array, header in prefetch_fits_files(paths, read_ahead=4, timer=timer):
+            ...
+    """
+    file_paths = list(file_paths)
+
+    def timed_load(file_path):
+        start = time.perf_counter()
+        result = loader(file_path)
+        if timer is not None:
+            timer.add('read', time.perf_counter() - start)
+        return result
+
+    if read_ahead <= 0:
+        for file_path in file_paths:
+            data_array, header = timed_load(file_path)
+            yield file_path, data_array, header
+        return
+
+    with ThreadPoolExecutor(max_workers=read_ahead, thread_name_prefix='fits-prefetch') as executor:
+        pending = []
+        next_index = 0
+        # prime the pipeline with read_ahead + 1 files: the one we're about to hand out plus the look-ahead
+        while next_index < len(file_paths) and len(pending) <= read_ahead:
+            pending.append((file_paths[next_index], executor.submit(timed_load, file_paths[next_index])))
+            next_index += 1
+        try:
+            while pending:
+                file_path, future = pending.pop(0)
+                start = time.perf_counter()
+                data_array, header = future.result()
+                if timer is not None:
+                    timer.add('read wait', time.perf_counter() - start)
+                if next_index < len(file_paths):
+                    pending.append((file_paths[next_index], executor.submit(timed_load, file_paths[next_index])))
+                    next_index += 1
+                yield file_path, data_array, header
+        finally:
+            # loop broken early, don't leave reads running in the background
+            for _, future in pending:
+                future.cancel()
+
+def list_fits_files(folder_path, suffix='.fits'):
+    """
+    same file selection the folder loops always did, returned as complete paths. bundles (and .npz bundles) are expanded
+    into one path per map inside them, check expand_bundles() in fits_output.py
+    """
+    file_paths = [os.path.join(folder_path, filename) for filename in os.listdir(folder_path) if filename.endswith((suffix, '.npz'))]
+    return expand_bundles(file_paths)
+
+class BackgroundWriter:
+    """
+    one writer thread fed by a bounded queue, submit() blocks once max_pending writes are waiting so
+    results can't pile up in memory faster than the disk takes them
+
+    usage:
+        with BackgroundWriter(max_pending=4, timer=timer) as writer:
+            writer.submit(save_map, std_array, header, output_path)
+
+    any exception raised by a write is re-raised from submit() or close() so failures aren't silently dropped
+
+    Args:
+        max_pending (int): queue size, how many writes can be waiting at once
+        timer (StageTimer or None): records 'write' time (writer thread) and 'write wait' time (compute loop blocked on a full queue)
+    """
+    _stop = object()
+
+    def __init__(self, max_pending=4, timer=None):
+        self.timer = timer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='fits-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._stop:
+                    return
+                if self._error is not None:
+                    continue # already failed, drain the queue without running the writes queued behind the failure
+                function, args, kwargs = item
+                start = time.perf_counter()
+                try:
+                    function(*args, **kwargs)
+                except BaseException as e:
+                    self._error = e
+                if self.timer is not None:
+                    self.timer.add('write', time.perf_counter() - start)
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error # stays set, so nothing queued after it runs and close() raises it too
+
+    def submit(self, function, *args, **kwargs):
+        """
+        queue function(*args, **kwargs) to run on the writer thread, don't modify the arrays you hand in afterwards
+        """
+        self._raise_if_failed()
+        start = time.perf_counter()
+        self._queue.put((function, args, kwargs))
+        if self.timer is not None:
+            self.timer.add('write wait', time.perf_counter() - start)
+
+    def close(self):
+        """
+        wait for every queued write to finish and stop the thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join()
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
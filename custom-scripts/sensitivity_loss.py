@@ -0,0 +1,85 @@
+"""
+sensitivity_loss.py
+
+Description: the contrast / sensitivity-loss math from magnitude-loss-sensitivity-automated.py and the
+automatic-sensitivity-loss-*.py scripts, in a file that can be imported (by the nircam-analysis command, sweep drivers...)
+"""
+import json
+import numpy as np
+
+def read_calibration(table_path, source, filter_name, mask, allow_measured=False):
+    """
+    read the host star's calibration entry, written by pancake-simulations/stellar_calibration.py
+
+    Args:
+        table_path (string): the json calibration table
+        source, filter_name, mask (string): which host/filter/mask the simulations used
+        allow_measured (bool): accept an entry that only has the simulated offaxis_peak_flux_measured, check stellar_flux_from()
+
+    Returns:
+        entry: dict with offaxis_peak_flux (and/or offaxis_peak_flux_measured) and host_magnitude
+    """
+    with open(table_path) as file:
+        table = json.load(file)
+    key = f'{source}|{filter_name}|{mask}'
+    if key not in table:
+        raise KeyError(f"err! no calibration for {key} in {table_path}, run stellar_calibration.py for it first")
+    entry = table[key]
+    if 'offaxis_peak_flux' not in entry and not (allow_measured and 'offaxis_peak_flux_measured' in entry):
+        stellar_flux_from(entry, allow_measured) # raises, here rather than halfway through a folder
+    return entry
+
+def stellar_flux_from(entry, allow_measured=False):
+    """
+    peak stellar off-axis flux out of a calibration entry: pancake's own offaxis_peak_flux, or with allow_measured the
+    approximation stellar_calibration.py simulates (offaxis_peak_flux_measured), which won't exactly match pancake's number
+    """
+    if 'offaxis_peak_flux' in entry:
+        return entry['offaxis_peak_flux']
+    if 'offaxis_peak_flux_measured' in entry:
+        if allow_measured:
+            print(f"using the simulated offaxis_peak_flux_measured ({entry.get('offaxis_peak_flux_measured_method')}), not pancake's offaxis_peak_flux")
+            return entry['offaxis_peak_flux_measured']
+        raise KeyError("err! the calibration entry only has the simulated offaxis_peak_flux_measured, allow it explicitly "
+                       "(allow_measured=True / --allow-measured-flux) or put pancake's number in with record_calibration()")
+    raise KeyError("err! no offaxis_peak_flux in the calibration entry, run stellar_calibration.py for it first")
+
+def array_operations(data_array, sigma_contrast, stellar_flux):
+    """
+    turn an STD map into a contrast image (CI) in magnitudes
+
+    Args:
+        data_array (numpy array): STD map
+        sigma_contrast (float): detection threshold in sigma, 5 for the paper
+        stellar_flux (float): peak stellar off-axis flux, from the calibration table
+
+    Returns:
+        magnitude_sensitive_array (numpy array): -2.5 log10(sigma_contrast * STD / stellar_flux)
+    """
+    sigmaed_array = data_array * sigma_contrast # multiplied by 5
+    fluxed_array = sigmaed_array / stellar_flux # divided by peak stellar offaxis flux
+    magnitude_sensitive_array = -2.5 * np.log10(fluxed_array) # now make it magnitude units
+    return magnitude_sensitive_array
+
+def sensitivity_loss(post_operations_control_STD, post_operations_STD_of_interest):
+    """
+    magnitude sensitivity loss (MSL): contrast image of the control minus contrast image of the scenario, positive = sensitivity lost
+    """
+    return np.array(post_operations_control_STD) - np.array(post_operations_STD_of_interest)
+
+def find_max_loss(data_array):
+    average = np.average(data_array) #just the average of your input data array values
+    return average
+
+def find_local_loss(data_array, x_location, y_location, arcsec_per_pixel=0.063):
+    """
+    average loss within 1 arcsecond of (x_location, y_location), i.e. around the off-axis companion
+    """
+    rows, columns = data_array.shape if data_array.ndim == 2 else data_array.shape[1:]
+    x_coords, y_coords = np.meshgrid(np.arange(columns), np.arange(rows))
+    distances = np.sqrt((x_coords - x_location)**2 + (y_coords - y_location)**2)
+    radius_pixels = 1 / arcsec_per_pixel
+    mask = distances <= radius_pixels
+    pixel_subset = data_array[mask]
+    average_loss = np.average(pixel_subset)
+    return average_loss
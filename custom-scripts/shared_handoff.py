@@ -0,0 +1,290 @@
+"""
+shared_handoff.py
+
+Description: hand subtraction arrays from the simulation sweep straight to the analysis stage through shared memory
+normally every product goes through disk twice: pancake writes the RDI subtraction .fits, then infinity-std.py and
+magnitude-loss-sensitivity-automated.py read it back to make the STD and sensitivity loss maps. with this the sweep
+publishes each subtraction array into a multiprocessing.shared_memory block plus a small descriptor (block name, shape,
+dtype, sweep parameters), a pool of analysis processes picks the descriptors up, does STD -> contrast image -> sensitivity
+loss right on the shared block and only the final loss map gets written.
+
+the control STD has to come out of the same subtraction as the published arrays, otherwise every loss map partly measures
+the difference between the two subtraction pipelines instead of the companion (rotations-automation.py builds both with
+batched_klip.py for that reason).
+
+usage:
+    pool = AnalysisPool(control_std, stellar_flux, output_folder)        # starts the analysis processes
+    for each sweep point:
+        residual = ...                                                   # subtraction array, in memory
+        pool.submit(residual, {'r': r_value, 'theta': theta}, name=f'R{r_value}-Theta{theta}')
+    summaries = pool.close()                                             # waits for the analysis to finish
+
+submit() blocks once max_pending blocks are waiting, so a fast sweep can't fill up /dev/shm.
+wait(descriptor) blocks until that one array is analysed and returns its summary, for callers that have to know the loss map
+exists before moving on (a work queue worker marking its point done).
+the producer never unlinks a block, the analysis process that consumed it does (or the pool does, if analysis failed).
+an analysis process that dies (killed, out of memory) doesn't hang the pool: the array it was on gets an error summary and
+a fresh process takes over the rest of the queue.
+"""
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+
+def create_block(size):
+    """
+    new shared memory block that the resource tracker of *this* process won't delete when it exits,
+    since the consumer process is the one that unlinks it
+    """
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False) # python >= 3.13
+    except TypeError:
+        from multiprocessing import resource_tracker
+        block = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+def attach_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name) # older pythons track attached blocks too, unlink() untracks it again
+
+def publish_array(data_array, params=None, name=None):
+    """
+    copy an array into a fresh shared memory block
+
+    Args:
+        data_array (numpy array): e.g. the RDI subtraction of one sweep point
+        params (dict or None): sweep parameters that travel with it (r, theta, brightness...)
+        name (string or None): base filename for the products made from it
+
+    Returns:
+        descriptor (dict): small and picklable, everything the consumer needs to find and read the array
+    """
+    data_array = np.ascontiguousarray(data_array)
+    block = create_block(max(data_array.nbytes, 1))
+    np.ndarray(data_array.shape, dtype=data_array.dtype, buffer=block.buf)[...] = data_array
+    descriptor = {'block': block.name, 'shape': data_array.shape, 'dtype': data_array.dtype.str, 'params': params or {}, 'name': name}
+    block.close()
+    return descriptor
+
+def consume_array(descriptor, function):
+    """
+    run function(array, descriptor) on the shared array without copying it, then free the block
+    """
+    block = attach_block(descriptor['block'])
+    try:
+        data_array = np.ndarray(descriptor['shape'], dtype=np.dtype(descriptor['dtype']), buffer=block.buf)
+        result = function(data_array, descriptor)
+        del data_array # no views into the buffer may survive block.close()
+        return result
+    finally:
+        block.close()
+        block.unlink()
+
+def discard_block(descriptor):
+    try:
+        block = attach_block(descriptor['block'])
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+class LossAnalysis:
+    """
+    what each analysis process does with a subtraction array: local STD map -> contrast image -> sensitivity loss against
+    the control, written with fits_output. same numbers as infinity-std.py + magnitude-loss-sensitivity-automated.py
+
+    Args:
+        control_std (string or numpy array): STD map of the control scenario (or the path to it), made from the same kind of
+                                             subtraction as the arrays handed to the pool
+        stellar_flux (float): peak stellar off-axis flux, from the calibration table
+        output_folder (string): where the -MSL-<suffix>.fits maps go
+        lambda_over_d (float or None): disk radius in pixels, 4.5 micron / 5.2 m like the paper by default
+        sigma_contrast (float): detection threshold in sigma
+        estimator (string): local_noise estimator for the STD step
+        output_settings (OutputSettings or None): how the loss maps get written
+        suffix (string): output name suffix
+        keep_std (bool): also write the STD maps (off by default, that's the point)
+    """
+    def __init__(self, control_std, stellar_flux, output_folder, lambda_over_d=None, sigma_contrast=5, estimator='std',
+                 output_settings=None, suffix='control-20', keep_std=False):
+        self.control_std = control_std
+        self.stellar_flux = stellar_flux
+        self.output_folder = output_folder
+        self.lambda_over_d = lambda_over_d
+        self.sigma_contrast = sigma_contrast
+        self.estimator = estimator
+        self.output_settings = output_settings
+        self.suffix = suffix
+        self.keep_std = keep_std
+        self._control = None
+
+    def __call__(self, data_array, descriptor):
+        from fits_output import read_map, write_map
+        from local_noise import find_lambda_over_d, find_local_noise
+        from sensitivity_loss import array_operations, find_max_loss, sensitivity_loss
+        if self._control is None:
+            control_std = self.control_std
+            if isinstance(control_std, str):
+                control_std, _ = read_map(control_std) # once per analysis process
+            self._control = array_operations(control_std, self.sigma_contrast, self.stellar_flux)
+        lambda_over_d = self.lambda_over_d or find_lambda_over_d(4.5e-6, 5.2)
+        std_map = find_local_noise(data_array, lambda_over_d, estimator=self.estimator)
+        loss = sensitivity_loss(self._control, array_operations(std_map, self.sigma_contrast, self.stellar_flux))
+        name = descriptor['name'] or descriptor['block']
+        output_path = os.path.join(self.output_folder, f'{name}-MSL-{self.suffix}.fits')
+        write_map(loss, None, output_path, self.output_settings)
+        if self.keep_std:
+            write_map(std_map, None, os.path.join(self.output_folder, f'{name}-std.fits'), self.output_settings)
+        return {'name': name, 'params': descriptor['params'], 'output_path': output_path, 'total_loss': float(find_max_loss(loss))}
+
+def _analysis_worker(tasks, results, analysis, current):
+    while True:
+        descriptor = tasks.get()
+        if descriptor is None:
+            return
+        current.value = descriptor['block'].encode() # so the pool knows what was lost if this process dies
+        try:
+            summary = consume_array(descriptor, analysis)
+        except Exception:
+            discard_block(descriptor)
+            summary = {'name': descriptor['name'], 'params': descriptor['params'], 'error': traceback.format_exc()}
+        results.put((descriptor['block'], summary))
+        current.value = b''
+
+class AnalysisPool:
+    """
+    analysis processes fed with shared memory descriptors through a bounded queue
+
+    Args:
+        control_std, stellar_flux, output_folder, **analysis_kwargs: see LossAnalysis
+        processes (int or None): analysis processes, half the cores by default (the other half is running the sweep)
+        max_pending (int): published blocks allowed to wait for analysis before submit() blocks
+        analysis (callable or None): swap in your own function(array, descriptor) -> picklable summary instead of LossAnalysis
+        poll_interval (float): seconds to wait for a result before checking that the analysis processes are still alive
+    """
+    def __init__(self, control_std=None, stellar_flux=None, output_folder='.', processes=None, max_pending=8, analysis=None,
+                 poll_interval=5.0, **analysis_kwargs):
+        if analysis is None:
+            analysis = LossAnalysis(control_std, stellar_flux, output_folder, **analysis_kwargs)
+        processes = processes or max(1, (os.cpu_count() or 2) // 2)
+        self._context = multiprocessing.get_context('spawn') # pancake and threads don't mix with fork
+        self._analysis = analysis
+        self._tasks = self._context.Queue(maxsize=max_pending)
+        self._results = self._context.Queue()
+        self.poll_interval = poll_interval
+        self._pending = {} # block -> descriptor, submitted and not summarised yet
+        self._summaries = {} # block -> summary
+        self._order = [] # blocks in the order they were submitted
+        self._workers = [] # (process, shared array with the name of the block it is working on)
+        for _ in range(processes):
+            self._start_worker()
+
+    def _start_worker(self):
+        current = self._context.Array('c', 256)
+        worker = self._context.Process(target=_analysis_worker, args=(self._tasks, self._results, self._analysis, current), daemon=True)
+        worker.start()
+        self._workers.append((worker, current))
+
+    def submit(self, data_array, params=None, name=None):
+        """
+        publish one subtraction array for analysis, returns its descriptor
+        """
+        descriptor = publish_array(data_array, params, name)
+        try:
+            self._tasks.put(descriptor)
+        except BaseException:
+            discard_block(descriptor)
+            raise
+        self._pending[descriptor['block']] = descriptor
+        self._order.append(descriptor['block'])
+        return descriptor
+
+    def _collect(self, timeout):
+        """
+        take one summary off the results queue, if none comes within timeout make sure the analysis processes are still alive
+        """
+        try:
+            block, summary = self._results.get(timeout=timeout)
+        except queue.Empty:
+            self._check_workers()
+            return
+        self._pending.pop(block, None)
+        self._summaries[block] = summary
+
+    def _check_workers(self):
+        for worker, current in list(self._workers):
+            if worker.is_alive():
+                continue
+            self._workers.remove((worker, current))
+            while True: # anything it managed to send before dying
+                try:
+                    block, summary = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                self._pending.pop(block, None)
+                self._summaries[block] = summary
+            descriptor = self._pending.pop(current.value.decode(), None)
+            if descriptor is not None:
+                discard_block(descriptor)
+                self._summaries[descriptor['block']] = {'name': descriptor['name'], 'params': descriptor['params'],
+                                                        'error': f'analysis process {worker.pid} died (exit code {worker.exitcode})'}
+            print(f"analysis process {worker.pid} died (exit code {worker.exitcode}), starting a new one")
+            self._start_worker() # the arrays still queued need somebody
+
+    def wait(self, descriptor, timeout=None):
+        """
+        block until the array behind descriptor (what submit() returned) is analysed
+
+        Returns:
+            summary (dict): with 'error' instead of 'output_path' if its analysis failed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while descriptor['block'] not in self._summaries:
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"err! no analysis result for {descriptor['name']} after {timeout} s")
+            self._collect(self.poll_interval)
+        return self._summaries[descriptor['block']]
+
+    def close(self, timeout=None):
+        """
+        wait for every submitted array to be analysed and stop the processes
+
+        Args:
+            timeout (float or None): seconds to wait for the analysis at most, arrays still unanalysed after that get an error summary
+
+        Returns:
+            summaries (list of dicts): one per submitted array, with 'error' instead of 'output_path' if its analysis failed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._pending and (deadline is None or time.time() < deadline):
+            self._collect(self.poll_interval)
+        if self._pending:
+            for worker, _ in self._workers:
+                worker.terminate() # stuck, and the queue may still be full so a sentinel wouldn't get through
+            for block, descriptor in self._pending.items():
+                discard_block(descriptor)
+                self._summaries[block] = {'name': descriptor['name'], 'params': descriptor['params'], 'error': f'no analysis result after {timeout} s'}
+            self._pending.clear()
+        else:
+            for _ in self._workers:
+                self._tasks.put(None)
+        for worker, _ in self._workers:
+            worker.join()
+        summaries = [self._summaries[block] for block in self._order]
+        failed = [summary for summary in summaries if 'error' in summary]
+        for summary in failed:
+            print(f"analysis of {summary['name']} failed:\n{summary['error']}")
+        return summaries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
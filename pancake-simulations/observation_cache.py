@@ -0,0 +1,183 @@
+"""
+observation_cache.py
+
+Description: memoization of whole PanCAKE observation runs
+with ta_error='saved' seq.run() is deterministic, so re-running the control scene or a sweep point we've already done
+(same sources, exposures, mask, rolls...) is just burning hours. CachedScene and CachedSequence are stand-ins for
+pancake.scene.Scene and pancake.sequence.Sequence that write down every add_source()/add_observation() call. run() hashes
+all of that together with the run arguments and the PanCAKE version, and if cache_folder already has a product under
+that hash it hands the product back instead of simulating.
+
+the real pancake objects are only built on a cache miss, so a hit doesn't even do the SIMBAD lookups.
+
+usage (swap in for the pancake classes, everything else stays the same):
+    target = CachedScene('Target')
+    target.add_source('HIP 65426', kind='simbad')
+    seq = CachedSequence()
+    seq.add_observation(target, exposures=[('F444W', 'DEEP8', 18, 5)], nircam_mask='MASK335R', rolls=[0])
+    results = seq.run(save_file='./control-scenario.fits', ta_error='saved', cache_folder='./pancake-cache')
+    image = scene_image(results, 'Target', 'F444W', 'MASK335R')          # one scene's image out of either kind of results
+
+notes:
+- only ta_error='saved' runs are cached, anything else has random target acquisition errors and always simulates
+- kind='file' sources are hashed by the file contents too, so editing the spectrum file invalidates the cache
+- kind='simbad' sources are hashed by name, if SIMBAD changes its photometry clear the cache folder
+- like every pancake import, the actual simulation still has to be kicked off from inside __name__=='__main__'
+"""
+import hashlib
+import json
+import os
+import shutil
+import socket
+
+CACHE_FORMAT = 1 # bump if what goes into the hash changes
+
+def pancake_version():
+    """
+    version of the installed PanCAKE, part of the hash so upgrading pancake doesn't hand back stale products
+    """
+    try:
+        from importlib.metadata import version
+        return version('pancake')
+    except Exception:
+        import pancake
+        return getattr(pancake, '__version__', 'unknown')
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class CachedScene:
+    """
+    records a pancake scene instead of building it, same add_source() arguments as pancake.scene.Scene
+
+    Args:
+        name (string): scene name, 'Target' / 'Reference' like in the scripts
+    """
+    def __init__(self, name):
+        self.name = name
+        self.sources = []
+        self._scene = None
+
+    def add_source(self, name, **kwargs):
+        source = {'name': name, 'kwargs': kwargs}
+        if kwargs.get('kind') == 'file' and kwargs.get('filename'):
+            source['file_sha256'] = file_digest(kwargs['filename'])
+        self.sources.append(source)
+
+    def spec(self):
+        return {'name': self.name, 'sources': [{'name': source['name'], 'kwargs': source['kwargs'], 'file_sha256': source.get('file_sha256')} for source in self.sources]}
+
+    def build(self):
+        """
+        the real pancake.scene.Scene, only made when we actually have to simulate
+        """
+        if self._scene is None:
+            import pancake
+            self._scene = pancake.scene.Scene(self.name)
+            for source in self.sources:
+                self._scene.add_source(source['name'], **source['kwargs'])
+        return self._scene
+
+class CachedSequence:
+    """
+    records a pancake sequence, same add_observation() arguments as pancake.sequence.Sequence, plus a cache-aware run()
+    """
+    def __init__(self):
+        self.observations = []
+
+    def add_observation(self, scene, exposures, **kwargs):
+        self.observations.append({'scene': scene, 'exposures': exposures, 'kwargs': kwargs})
+
+    def spec(self, **run_kwargs):
+        """
+        everything that decides what seq.run() produces, as plain json-friendly data
+        """
+        observations = []
+        for observation in self.observations:
+            kwargs = dict(observation['kwargs'])
+            if isinstance(kwargs.get('scale_exposures'), CachedScene):
+                kwargs['scale_exposures'] = kwargs['scale_exposures'].name # scaled to another scene in the same sequence, the name pins it down
+            observations.append({'scene': observation['scene'].spec(),
+                                 'exposures': [list(exposure) for exposure in observation['exposures']],
+                                 'kwargs': kwargs})
+        return {'cache_format': CACHE_FORMAT, 'pancake_version': pancake_version(), 'observations': observations, 'run': run_kwargs}
+
+    def spec_hash(self, **run_kwargs):
+        encoded = json.dumps(self.spec(**run_kwargs), sort_keys=True, default=repr)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def build(self):
+        """
+        the real pancake.sequence.Sequence with the real scenes in it
+        """
+        import pancake
+        sequence = pancake.sequence.Sequence()
+        for observation in self.observations:
+            kwargs = dict(observation['kwargs'])
+            if isinstance(kwargs.get('scale_exposures'), CachedScene):
+                kwargs['scale_exposures'] = kwargs['scale_exposures'].build()
+            sequence.add_observation(observation['scene'].build(), exposures=observation['exposures'], **kwargs)
+        return sequence
+
+    def run(self, save_file=None, ta_error='saved', cache_folder=None, **run_kwargs):
+        """
+        seq.run() that reuses an earlier identical run when there is one
+
+        Args:
+            save_file (string): where the product goes, same as pancake's save_file
+            ta_error (string): passed to pancake, only 'saved' runs are cached
+            cache_folder (string or None): where cached products live (<hash>.fits + <hash>.json with the spec), None turns caching off
+            **run_kwargs: anything else seq.run() takes, also part of the hash
+
+        Returns:
+            results: what pancake's seq.run() returns on a miss, the cached product opened as an HDUList on a hit
+                     (pancake.analysis.contrast_curve() takes either)
+        """
+        if cache_folder is None or save_file is None or ta_error != 'saved':
+            return self.build().run(save_file=save_file, ta_error=ta_error, **run_kwargs)
+
+        key = self.spec_hash(ta_error=ta_error, **run_kwargs)
+        cached_file = os.path.join(cache_folder, f'{key}.fits')
+        if os.path.exists(cached_file):
+            print(f"observation cache hit {key[:12]}, reusing {cached_file} for {save_file}")
+            if os.path.abspath(cached_file) != os.path.abspath(save_file):
+                shutil.copyfile(cached_file, save_file)
+            from astropy.io import fits
+            return fits.open(save_file)
+
+        results = self.build().run(save_file=save_file, ta_error=ta_error, **run_kwargs)
+        os.makedirs(cache_folder, exist_ok=True)
+        # temp file + rename so parallel workers (on any host sharing the cache) never see half a product or half a spec
+        writer = f'{socket.gethostname()}-{os.getpid()}'
+        temp_file = f'{cached_file}.{writer}.tmp'
+        shutil.copyfile(save_file, temp_file)
+        os.replace(temp_file, cached_file)
+        spec_file = os.path.join(cache_folder, f'{key}.json')
+        with open(f'{spec_file}.{writer}.tmp', 'w') as file:
+            json.dump(self.spec(ta_error=ta_error, **run_kwargs), file, indent=1, default=repr)
+        os.replace(f'{spec_file}.{writer}.tmp', spec_file)
+        print(f"observation cached as {key[:12]}")
+        return results
+
+def scene_image(results, scene_name, filter_name='F444W', mask='MASK335R'):
+    """
+    image of one scene out of the simulation results (what seq.run / CachedSequence.run returns), picked by exact SOURCE (scene name), FILTER and
+    CORONMSK header cards. exactly one image has to match, anything else is an error that lists the cards of every image in the results
+    rather than a guess, so a pancake version that labels its images differently stops here instead of subtracting the wrong images
+
+    which cards a seq.run product really carries has NOT been checked against an actual product yet, this layout (one image HDU per
+    scene/exposure, SOURCE = the Scene name, FILTER and CORONMSK as in JWST headers) is an assumption. the first run will tell: if
+    it's wrong the error above lists what is there, or print the headers of a saved product (e.g. control-scenario.fits from
+    control-simulation.py) with astropy, then fix the cards here (and this note) to match
+    """
+    matches = [hdu for hdu in results if hdu.data is not None and hdu.header.get('SOURCE') == scene_name
+               and hdu.header.get('FILTER') == filter_name and hdu.header.get('CORONMSK') == mask]
+    if len(matches) != 1:
+        found = [(hdu.name, hdu.header.get('SOURCE'), hdu.header.get('FILTER'), hdu.header.get('CORONMSK')) for hdu in results if hdu.data is not None]
+        raise ValueError(f"err! expected one image with SOURCE={scene_name} FILTER={filter_name} CORONMSK={mask} in the simulation results, "
+                         f"found {len(matches)}. images (EXTNAME, SOURCE, FILTER, CORONMSK): {found}")
+    return matches[0].data
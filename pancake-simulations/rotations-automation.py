@@ -4,30 +4,77 @@ Created March, 2024
 
 Description: An automated PanCAKE script utilized to generate simulations of off-axis reference sources at different rotations and arcsecond separations
 """
-def run_simulation(r_value, relative_brightness, theta):
+import os
+import sys
+from observation_cache import CachedScene, CachedSequence, scene_image
+#the shared memory hand-off uses batched_klip.py, local_noise.py and shared_handoff.py from ../custom-scripts. after `pip install .`
+#(repository root) they import from anywhere, this line covers running straight from a checkout without installing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'custom-scripts'))
+
+def batched_rdi_residual(results):
+    """
+    10 x 10 annuli x subsections RDI subtraction of the Reference scene from the Target scene, in memory (check batched_klip.py).
+    NOT pancake's contrast_curve subtraction the paper used, so only compare it with controls made the same way
+    """
+    from batched_klip import batched_klip_subtract
+    return batched_klip_subtract(scene_image(results, 'Target'), scene_image(results, 'Reference')[None], annuli=10, subsections=10)[0]
+
+def batched_control_std(output_folder='.', cache_folder=None):
+    """
+    STD map of the control scenario (control-simulation.py, no companion) through the same in-memory subtraction as the hand-off,
+    also written to output_folder for reference. the simulation itself comes out of the observation cache if control-simulation.py already ran
+    """
+    from fits_output import write_map
+    from local_noise import find_lambda_over_d, find_local_noise
+    target = CachedScene('Target')
+    target.add_source('HIP 65426', kind='simbad')
+    reference = CachedScene('Reference')
+    reference.add_source('HIP 65426', kind='simbad')
+    seq = CachedSequence()
+    seq.add_observation(target, exposures=[('F444W', 'DEEP8', 18, 5)], nircam_mask='MASK335R', rolls=[0])
+    seq.add_observation(reference, exposures=[('F444W', 'DEEP8', 18, 5)], nircam_mask='MASK335R', scale_exposures=target)
+    results = seq.run(save_file=os.path.join(output_folder, 'control-scenario.fits'), ta_error='saved', cache_folder=cache_folder)
+    control_std = find_local_noise(batched_rdi_residual(results), find_lambda_over_d(4.5e-6, 5.2))
+    write_map(control_std, None, os.path.join(output_folder, 'control-scenario-batched-RDI-subtraction-std.fits'))
+    return control_std
+
+def run_simulation(r_value, relative_brightness, theta, host_magnitude, output_folder='.', cache_folder=None, analysis_pool=None, wait_for_analysis=False):
     # Naming variables dynamically based on relative brightness and 'r' value
-    save_file = f"./no-planet-R{r_value}-RB{relative_brightness:.0e}-Theta{theta}.fits"
-    save_prefix = f"no-planet-R{r_value}-RB{relative_brightness:.0e}-Theta{theta}-RDI-subtraction"
+    save_file = os.path.join(output_folder, f"no-planet-R{r_value}-RB{relative_brightness:.0e}-Theta{theta}.fits")
+    save_prefix = os.path.join(output_folder, f"no-planet-R{r_value}-RB{relative_brightness:.0e}-Theta{theta}-RDI-subtraction")
 
     print(f'---------------------------------------------------------\n\n \n running no-planet-R{r_value}-RB{relative_brightness:.0e} Theta {theta} \n \n \n---------------------------------------------------------')
     #above line is just to help keep track of progress when this program is left to run overnight
-    target = pancake.scene.Scene('Target')
+    target = CachedScene('Target')
     target.add_source('HIP 65426', kind='simbad')
-    reference = pancake.scene.Scene('Reference')
+    reference = CachedScene('Reference')
     reference.add_source('HIP 65426', kind='simbad')
     #created this script after the magnitudes automation and realized no need to define it as a function
-    reference_magnitude = 6.77
-    magnitude = reference_magnitude - 2.5 * math.log10(relative_brightness)
+    #host_magnitude is the on-axis source magnitude in Ks, main() looks it up in the calibration table (stellar_calibration.py)
+    magnitude = host_magnitude - 2.5 * math.log10(relative_brightness)
 
     reference.add_source('Companion', kind='grid', theta = theta, r=r_value, spt='a2v', norm_val=magnitude, norm_unit='vegamag', norm_bandpass='2mass_ks')
     #the specified/dynamic parameters here are the theta value, r, and norm_val
 
-    seq = pancake.sequence.Sequence()
+    seq = CachedSequence()
     seq.add_observation(target, exposures=[('F444W', 'DEEP8', 18, 5)], nircam_mask='MASK335R', rolls=[0])
     seq.add_observation(reference, exposures=[('F444W', 'DEEP8', 18, 5)], nircam_mask='MASK335R', scale_exposures=target)
 
-    results = seq.run(save_file=save_file, ta_error='saved')
+    results = seq.run(save_file=save_file, ta_error='saved', cache_folder=cache_folder)
+    if analysis_pool is not None:
+        #shared memory hand-off (check shared_handoff.py): 10 x 10 RDI subtraction done in memory with batched_klip.py, no -RDI-subtraction .fits,
+        #the analysis processes turn it into the sensitivity loss map (against a control made the same way) while the next point simulates
+        descriptor = analysis_pool.submit(batched_rdi_residual(results), {'r_value': r_value, 'relative_brightness': relative_brightness, 'theta': theta},
+                                          name=f"no-planet-R{r_value}-RB{relative_brightness:.0e}-Theta{theta}")
+        if wait_for_analysis:
+            #with a work queue the point only counts as done once its -MSL- map exists, a failed analysis raises so the queue reruns the point
+            summary = analysis_pool.wait(descriptor)
+            if 'error' in summary:
+                raise RuntimeError(f"analysis of {summary['name']} failed:\n{summary['error']}")
+            return summary['output_path']
+        return save_file
     pancake.analysis.contrast_curve(results, target='Target', references='Reference', subtraction='RDI', save_prefix=save_prefix, klip_subsections=10, klip_annuli=10, sub_only=False, regis_err='saved')
+    return save_file
 
 if __name__ == '__main__':
     import math
@@ -36,6 +83,42 @@ if __name__ == '__main__':
     radii = [0.5, 1, 1.5, 2, 2.5, 3]  # Radial separations from 0.5" to 3" in steps of 0.5
     thetas = [0, 90, 180, 270]  # Different angles
     relative_brightness = 1/100000
-    for r_value in radii:
-        for theta in thetas:
-            run_simulation(r_value, relative_brightness, theta)
+    from stellar_calibration import get_calibration
+    host_magnitude = get_calibration('HIP 65426', 'F444W', 'MASK335R', need=('host_magnitude',))['host_magnitude'] # measured once, then read from the table
+    output_folder = '.' # where the simulations end up, with a queue this should be on the shared filesystem too
+    cache_folder = './pancake-cache' # identical ta_error='saved' runs are reused from here (check observation_cache.py), None to always simulate
+    handoff = None # None writes pancake's RDI subtraction files like before, 'shared_memory' hands the subtractions straight to
+    #analysis processes that only write the final -MSL- maps (check shared_handoff.py).
+    #the hand-off subtracts with batched_klip.py instead of pancake's contrast_curve, and the control goes through the same subtraction
+    #(batched_control_std) so the loss maps compare like with like. they are NOT the paper's pipeline, don't mix them with maps made from
+    #contrast_curve subtractions. needs the custom-scripts modules: `pip install .` from the repository root, or run from a checkout
+    analysis_processes = 2
+    queue_folder = '' # leave empty to run the whole grid right here like before.
+    #set it to a folder on a shared filesystem and start this script as many times as you want, on as many machines as you want;
+    #every copy claims grid points from the queue until the grid is done (check work_queue.py)
+    analysis_pool = None
+    if handoff == 'shared_memory':
+        from shared_handoff import AnalysisPool
+        from sensitivity_loss import stellar_flux_from
+        #only the peak flux from pancake's analysis.py goes in by default, set allow_measured_flux = True to let
+        #stellar_calibration.py simulate an approximation of it when the table has none (check stellar_calibration.py)
+        allow_measured_flux = False
+        entry = get_calibration('HIP 65426', 'F444W', 'MASK335R', need=('offaxis_peak_flux',) if allow_measured_flux else ())
+        stellar_flux = stellar_flux_from(entry, allow_measured=allow_measured_flux)
+        analysis_pool = AnalysisPool(batched_control_std(output_folder, cache_folder), stellar_flux, output_folder, processes=analysis_processes)
+    if queue_folder:
+        from functools import partial
+        from work_queue import WorkQueue, run_worker
+        queue = WorkQueue(queue_folder, stale_after=2 * 3600, heartbeat_interval=300) # one point can take a while, don't reclaim too eagerly
+        queue.populate([{'id': f"R{r_value}-RB{relative_brightness:.0e}-Theta{theta}",
+                         'params': {'r_value': r_value, 'relative_brightness': relative_brightness, 'theta': theta, 'output_folder': output_folder, 'cache_folder': cache_folder, 'host_magnitude': host_magnitude}}
+                        for r_value in radii for theta in thetas])
+        run_worker(queue, partial(run_simulation, analysis_pool=analysis_pool, wait_for_analysis=True)) # no overlap with the next point, but nothing is marked done early
+    else:
+        for r_value in radii:
+            for theta in thetas:
+                run_simulation(r_value, relative_brightness, theta, host_magnitude, output_folder, cache_folder, analysis_pool)
+    if analysis_pool is not None:
+        for summary in analysis_pool.close():
+            if 'total_loss' in summary:
+                print(f"{summary['name']}: average sensitivity loss {summary['total_loss']:.3f} mag")
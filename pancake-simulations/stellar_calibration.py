@@ -0,0 +1,151 @@
+"""
+stellar_calibration.py
+
+Description: calibration stage for the host star numbers the sensitivity-loss pipeline needs
+magnitude-loss-sensitivity-automated.py used stellar_flux = 68747.44677595097, copied by hand from a debug print of
+offaxis_peak_flux in pancake's analysis.py, and the sweeps hard-coded the host's 6.77 Ks magnitude. changing the host,
+the filter or the mask meant an instrumented pancake run and editing constants.
+
+now both numbers live in a small json calibration table, one entry per (source, filter, mask):
+    {"HIP 65426|F444W|MASK335R": {"offaxis_peak_flux": ..., "host_magnitude": ..., "host_magnitude_band": "2mass_ks", ...}}
+get_calibration() returns the entry and only measures whatever is missing, so each star/filter/mask combination is measured once.
+offaxis_peak_flux is only ever pancake's own number (put in with record_calibration()), a simulated one is stored as
+offaxis_peak_flux_measured and the loss pipeline only uses it when asked to (allow_measured in sensitivity_loss.py).
+calibration-table.json next to this file comes seeded with the paper's numbers for HIP 65426 / F444W / MASK335R.
+
+how the numbers are measured:
+- host_magnitude -- SIMBAD photometry in the band the companions are normalised in (2MASS Ks for the paper, that's the 6.77)
+- offaxis_peak_flux_measured -- pancake simulation of the host on its own, placed offaxis_r arcseconds off the mask center so the
+  coronagraph doesn't touch the core, same exposure/mask/ta_error='saved' as the science runs, and the peak pixel of the image.
+  this is NOT pancake's own offaxis_peak_flux (analysis.py computes that internally), it only approximates it, so contrast
+  values made with a measured entry won't exactly match ones made with the paper's number. check a new entry against a known
+  one, or put pancake's number in by hand with record_calibration()
+"""
+import json
+import os
+import time
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration-table.json') # same table wherever the script is run from
+SIMBAD_BANDS = {'2mass_ks': 'K', '2mass_h': 'H', '2mass_j': 'J', 'johnson,v': 'V', 'johnson,b': 'B'} # pancake norm_bandpass -> SIMBAD filter
+
+def calibration_key(source, filter_name, mask):
+    return f'{source}|{filter_name}|{mask}'
+
+def load_calibration_table(table_path=DEFAULT_TABLE):
+    if not os.path.exists(table_path):
+        return {}
+    with open(table_path) as file:
+        return json.load(file)
+
+def save_calibration_table(table, table_path=DEFAULT_TABLE):
+    # temp file + rename, several sweep workers might be calibrating at the same time
+    temp_path = f'{table_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(table, file, indent=1, sort_keys=True)
+    os.replace(temp_path, table_path)
+
+def record_calibration(source, filter_name, mask, table_path=DEFAULT_TABLE, **values):
+    """
+    put numbers into the table by hand (or after measuring them), merges with whatever is already there
+
+    example usage, seeding the table with the value used for the paper:
+        record_calibration('HIP 65426', 'F444W', 'MASK335R', offaxis_peak_flux=68747.44677595097, offaxis_peak_flux_method='pancake analysis.py debug print',
+                           host_magnitude=6.77, host_magnitude_band='2mass_ks')
+    """
+    table = load_calibration_table(table_path)
+    entry = table.setdefault(calibration_key(source, filter_name, mask), {})
+    entry.update(values)
+    entry['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    save_calibration_table(table, table_path)
+    return entry
+
+def measure_host_magnitude(source, band='2mass_ks'):
+    """
+    host magnitude from SIMBAD in the band the companions get normalised in
+
+    Args:
+        source (string): SIMBAD name, e.g. 'HIP 65426'
+        band (string): pancake norm_bandpass name, see SIMBAD_BANDS
+
+    Returns:
+        magnitude (float)
+    """
+    from astroquery.simbad import Simbad
+    simbad_band = SIMBAD_BANDS[band]
+    simbad = Simbad()
+    try:
+        simbad.add_votable_fields(simbad_band) # astroquery >= 0.4.8
+    except Exception:
+        simbad.add_votable_fields(f'flux({simbad_band})') # older astroquery
+    result = simbad.query_object(source)
+    if result is None:
+        raise ValueError(f"err! SIMBAD doesn't know {source}")
+    for column in (simbad_band, f'FLUX_{simbad_band}', f'flux({simbad_band})'):
+        if column in result.colnames:
+            return float(result[column][0])
+    raise ValueError(f"err! no {band} magnitude for {source} in SIMBAD")
+
+def measure_offaxis_peak_flux(source, filter_name, mask, exposure=('DEEP8', 18, 5), offaxis_r=2.5, save_file='./calibration-offaxis.fits'):
+    """
+    peak pixel of the host simulated away from the mask center, the normalisation for contrast / sensitivity maps
+
+    Args:
+        source (string): host name, simulated with kind='simbad' like in the science runs
+        filter_name, mask (string): e.g. 'F444W', 'MASK335R'
+        exposure (tuple): (readout pattern, ngroups, nints), same as the science exposures
+        offaxis_r (float): arcseconds off the mask center, far enough out that the coronagraph doesn't dim the core
+        save_file (string): where pancake writes the calibration simulation
+
+    Returns:
+        peak_flux (float)
+    """
+    import numpy as np
+    import pancake
+    from observation_cache import scene_image
+    scene = pancake.scene.Scene('Calibration')
+    scene.add_source(source, kind='simbad', r=offaxis_r)
+    seq = pancake.sequence.Sequence()
+    seq.add_observation(scene, exposures=[(filter_name,) + tuple(exposure)], nircam_mask=mask, rolls=[0])
+    results = seq.run(save_file=save_file, ta_error='saved')
+    image = np.asarray(scene_image(results, 'Calibration', filter_name, mask), dtype=float) # exactly this scene/filter/mask or an error
+    if image.ndim == 3:
+        image = np.nanmean(image, axis=0) # collapse integrations/frames first so a single cosmic ray can't be the peak
+    return float(np.nanmax(image))
+
+def get_calibration(source, filter_name, mask, table_path=DEFAULT_TABLE, band='2mass_ks', need=('host_magnitude', 'offaxis_peak_flux'), **measure_kwargs):
+    """
+    calibration entry for (source, filter, mask), measuring and storing only the quantities in need that aren't in the table yet
+
+    Args:
+        source, filter_name, mask (string): which calibration
+        table_path (string): json calibration table
+        band (string): band for the host magnitude (pancake norm_bandpass name)
+        need (tuple): which quantities the caller needs, anything else missing is left alone. 'offaxis_peak_flux' only gets
+                      simulated (as offaxis_peak_flux_measured) if the entry has neither pancake's number nor a measured one
+        **measure_kwargs: passed on to measure_offaxis_peak_flux()
+
+    Returns:
+        entry (dict): with at least the quantities in need
+    """
+    entry = load_calibration_table(table_path).get(calibration_key(source, filter_name, mask), {})
+    measured = {}
+    if 'host_magnitude' in need and ('host_magnitude' not in entry or entry.get('host_magnitude_band') != band):
+        print(f"calibrating host magnitude of {source} in {band}")
+        measured['host_magnitude'] = measure_host_magnitude(source, band)
+        measured['host_magnitude_band'] = band
+    if 'offaxis_peak_flux' in need and 'offaxis_peak_flux' not in entry and 'offaxis_peak_flux_measured' not in entry:
+        print(f"calibrating off-axis peak flux of {source} in {filter_name} with {mask} (approximation of pancake's offaxis_peak_flux, check stellar_calibration.py)")
+        measured['offaxis_peak_flux_measured'] = measure_offaxis_peak_flux(source, filter_name, mask, **measure_kwargs)
+        measured['offaxis_peak_flux_measured_method'] = f"pancake off-axis simulation, r={measure_kwargs.get('offaxis_r', 2.5)}\""
+    if measured:
+        entry = record_calibration(source, filter_name, mask, table_path, **measured)
+    return entry
+
+if __name__ == '__main__':
+    #PanCAKE has to be run from inside __name__=='__main__', same as the other simulation scripts
+    source = 'HIP 65426'
+    filter_name = 'F444W'
+    mask = 'MASK335R'
+    table_path = DEFAULT_TABLE
+    entry = get_calibration(source, filter_name, mask, table_path)
+    print(f"{calibration_key(source, filter_name, mask)}: {entry}")
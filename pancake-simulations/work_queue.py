@@ -0,0 +1,311 @@
+"""
+work_queue.py
+
+Description: a work queue that lives in a plain folder so sweeps can be split across any number of worker processes,
+on one machine or on several machines that share a filesystem. nothing to install, no server to keep alive.
+
+the queue folder looks like:
+    queue_folder/pending/<point id>.json   -- sweep points nobody has started
+    queue_folder/claimed/<point id>.json   -- points a worker is running right now, the worker touches the file every heartbeat
+    queue_folder/done/<point id>.json      -- finished points, with who ran them and how long it took
+    queue_folder/failed/<point id>.json    -- points that raised an error max_attempts times
+    queue_folder/.populated                -- appears once whichever worker got there first has filled the queue, so it only gets filled once
+
+how it works:
+1. claiming is an os.rename() from pending/ to claimed/. rename is atomic, so when two workers go for the same point only one wins.
+   rename keeps the pending file's old mtime, so the claim is touched right away, and a claim record without claimed_at
+   (renamed but not written yet) only counts as dead once it has sat untouched for another stale_after seconds
+   after a reclaimer first saw it like that
+2. while a point runs, a heartbeat thread keeps bumping the claim file's modification time
+3. a claim whose modification time is older than stale_after seconds belongs to a dead worker (crashed, killed, node went down)
+   and any worker that runs out of pending points renames it back to pending/ so it gets rerun. the reclaimer first renames
+   it to pending/<point id>.json.<worker>.reclaim, if it gets killed before the second rename that file is picked up again
+   the same way once it has sat untouched for stale_after seconds
+4. "now" is taken from the shared filesystem (mtime of a freshly touched file) rather than the local clock, so hosts
+   with slightly different clocks don't reclaim each other's live points
+
+test it locally by running `python work_queue.py`, which runs a few workers against a temporary folder with a dummy job,
+tests/test_work_queue.py covers reclaiming and the claim/reclaim races
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+class WorkQueue:
+    """
+    Args:
+        queue_folder (string): shared folder holding the queue, created if it doesn't exist
+        stale_after (float): seconds without a heartbeat before a claim is considered dead, keep it well above heartbeat_interval
+        heartbeat_interval (float): seconds between heartbeats on a running claim
+        max_attempts (int): how many times a point is tried (errors or dead workers) before it goes to failed/
+    """
+    STATES = ('pending', 'claimed', 'done', 'failed')
+
+    def __init__(self, queue_folder, stale_after=900.0, heartbeat_interval=60.0, max_attempts=3):
+        if stale_after <= 2 * heartbeat_interval:
+            raise ValueError("err! stale_after has to be comfortably bigger than heartbeat_interval")
+        self.queue_folder = queue_folder
+        self.stale_after = stale_after
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self._suspects = {} # path -> (filesystem time first seen, mtime) of files whose mtime alone doesn't say they're dead
+        for state in self.STATES + ('.clock',):
+            os.makedirs(os.path.join(queue_folder, state), exist_ok=True)
+
+    def path(self, state, point_id):
+        return os.path.join(self.queue_folder, state, f'{point_id}.json')
+
+    def write_record(self, state, point_id, record):
+        # write to a temp file then rename, so nobody ever reads half a record
+        final_path = self.path(state, point_id)
+        temp_path = f'{final_path}.{socket.gethostname()}-{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(record, file, indent=1)
+        os.replace(temp_path, final_path)
+
+    def read_record(self, state, point_id):
+        with open(self.path(state, point_id)) as file:
+            return json.load(file)
+
+    def point_ids(self, state):
+        return sorted(name[:-len('.json')] for name in os.listdir(os.path.join(self.queue_folder, state)) if name.endswith('.json'))
+
+    def populate(self, points, wait_interval=1.0):
+        """
+        fill the queue with sweep points, only the first worker to get here actually does it and everyone else
+        waits until it's finished writing them, so nobody sees an empty queue and quits early
+
+        Args:
+            points (list of dicts): each with an 'id' (unique, safe to use as a filename) and 'params' (kwargs for the job)
+            wait_interval (float): seconds between checks while another worker is filling the queue
+
+        Returns:
+            populated (bool): True if this call filled the queue, False if somebody already had
+        """
+        if self.is_populated():
+            return False
+        lock_path = os.path.join(self.queue_folder, '.populating')
+        try:
+            lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            while not self.is_populated():
+                time.sleep(wait_interval)
+            return False
+        ids = [point['id'] for point in points]
+        if len(set(ids)) != len(ids):
+            raise ValueError("err! sweep point ids have to be unique")
+        for point in points:
+            self.write_record('pending', point['id'], {'id': point['id'], 'params': point['params'], 'attempts': 0})
+        os.write(lock, f'{len(points)} points by {worker_name()} at {time.ctime()}\n'.encode())
+        os.close(lock)
+        os.rename(lock_path, os.path.join(self.queue_folder, '.populated'))
+        return True
+
+    def is_populated(self):
+        return os.path.exists(os.path.join(self.queue_folder, '.populated'))
+
+    def claim(self, worker_id):
+        """
+        grab the next pending point, returns its record or None if there's nothing left to grab
+        """
+        for point_id in self.point_ids('pending'):
+            try:
+                os.rename(self.path('pending', point_id), self.path('claimed', point_id))
+            except FileNotFoundError:
+                continue # another worker renamed it first
+            try:
+                os.utime(self.path('claimed', point_id)) # rename kept the mtime from when it was queued, don't look stale
+                record = self.read_record('claimed', point_id)
+            except FileNotFoundError:
+                continue # finished or reclaimed by someone else in the meantime
+            record['attempts'] += 1
+            record['worker'] = worker_id
+            record['claimed_at'] = time.time()
+            self.write_record('claimed', point_id, record)
+            return record
+        return None
+
+    def heartbeat(self, point_id):
+        try:
+            os.utime(self.path('claimed', point_id))
+        except FileNotFoundError:
+            pass # got reclaimed from under us (we were too slow to heartbeat), the result still gets recorded when we finish
+
+    def filesystem_now(self, worker_id):
+        """
+        current time according to the shared filesystem, so every host compares mtimes against the same clock
+        """
+        clock_path = os.path.join(self.queue_folder, '.clock', worker_id)
+        with open(clock_path, 'a'):
+            os.utime(clock_path)
+        return os.stat(clock_path).st_mtime
+
+    def untouched_for_a_while(self, file_path, now, seen):
+        """
+        True once file_path has sat unchanged for stale_after seconds since this worker first saw it looking dead.
+        for files whose own mtime can't be trusted: rename keeps the old mtime, so a claim or reclaim that's still
+        being written looks just as old as an abandoned one
+        """
+        mtime = os.stat(file_path).st_mtime
+        first_seen, seen_mtime = self._suspects.get(file_path, (now, mtime))
+        if seen_mtime != mtime:
+            first_seen = now # somebody is still working on it, start over
+        seen[file_path] = (first_seen, mtime)
+        return now - first_seen >= self.stale_after
+
+    def reclaim_stale(self, worker_id):
+        """
+        move claims that stopped heartbeating back to pending (or to failed once they're out of attempts), and finish
+        reclaims left half done by a reclaimer that died
+
+        Returns:
+            reclaimed (list of strings): ids of the points that were moved
+        """
+        now = self.filesystem_now(worker_id)
+        seen = {}
+        reclaimed = []
+        for point_id in self.point_ids('claimed'):
+            claim_path = self.path('claimed', point_id)
+            try:
+                age = now - os.stat(claim_path).st_mtime
+                if age < self.stale_after:
+                    continue
+                record = self.read_record('claimed', point_id)
+                if 'claimed_at' not in record and not self.untouched_for_a_while(claim_path, now, seen):
+                    continue # just renamed by claim(), which hasn't written its record yet (or died doing it)
+                # move it out of claimed/ under a name nobody lists, so only one reclaimer gets it, and drop claimed_at
+                # before it's visible again so the next claim starts out without it too
+                reclaim_path = f"{self.path('pending', point_id)}.{worker_id}.reclaim"
+                os.rename(claim_path, reclaim_path)
+            except FileNotFoundError:
+                continue # finished or reclaimed by someone else in the meantime
+            target_state = self.requeue(reclaim_path, point_id, record)
+            print(f"reclaimed {point_id} from {record.get('worker')} (no heartbeat for {age:.0f} s), moved to {target_state}")
+            reclaimed.append(point_id)
+
+        pending_folder = os.path.join(self.queue_folder, 'pending')
+        for name in sorted(os.listdir(pending_folder)):
+            if not name.endswith('.reclaim'):
+                continue
+            point_id = name.split('.json.', 1)[0]
+            left_path = os.path.join(pending_folder, name)
+            reclaim_path = f"{self.path('pending', point_id)}.{worker_id}.reclaim"
+            try:
+                if not self.untouched_for_a_while(left_path, now, seen):
+                    continue # most likely its reclaimer is about to rename it
+                os.rename(left_path, reclaim_path)
+                with open(reclaim_path) as file:
+                    record = json.load(file)
+            except FileNotFoundError:
+                continue
+            target_state = self.requeue(reclaim_path, point_id, record)
+            print(f"finished reclaiming {point_id} left behind in {name}, moved to {target_state}")
+            reclaimed.append(point_id)
+        self._suspects = seen # forget files that are gone
+        return reclaimed
+
+    def requeue(self, reclaim_path, point_id, record):
+        """
+        second half of a reclaim: rewrite the record at reclaim_path without claimed_at and rename it to pending/ or failed/
+        """
+        target_state = 'pending' if record['attempts'] < self.max_attempts else 'failed'
+        record.pop('claimed_at', None)
+        temp_path = f'{reclaim_path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(record, file, indent=1)
+        os.replace(temp_path, reclaim_path) # always a whole record in there, in case we die before the rename below
+        os.rename(reclaim_path, self.path(target_state, point_id))
+        return target_state
+
+    def finish(self, record, state, **details):
+        """
+        record a point as 'done' or 'failed' (failed points with attempts left go back to pending instead)
+        """
+        point_id = record['id']
+        if state == 'failed' and record['attempts'] < self.max_attempts:
+            state = 'pending'
+        record = dict(record, finished_at=time.time(), **details)
+        if state == 'pending':
+            record.pop('claimed_at', None) # it's a fresh pending point again, see claim()
+        self.write_record(state, point_id, record)
+        try:
+            os.remove(self.path('claimed', point_id))
+        except FileNotFoundError:
+            pass
+        return state
+
+    def status(self):
+        return {state: len(self.point_ids(state)) for state in self.STATES}
+
+def worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+def run_worker(queue, job, worker_id=None, poll_interval=30.0):
+    """
+    keep claiming and running points until the whole queue is done, start as many of these as you like, anywhere
+
+    Args:
+        queue (WorkQueue): the shared queue
+        job (function): called as job(**params) for each point, whatever it returns goes in the done record (keep it json friendly)
+        worker_id (string or None): name in the claim records, hostname-pid by default
+        poll_interval (float): seconds to wait before checking again when other workers still hold claims
+
+    Returns:
+        completed (int): number of points this worker finished
+    """
+    worker_id = worker_id or worker_name()
+    completed = 0
+    while True:
+        record = queue.claim(worker_id)
+        if record is None:
+            # nothing pending: either everything is done, or other workers are still running (or died holding) claims
+            if queue.reclaim_stale(worker_id):
+                continue
+            if not queue.point_ids('claimed'):
+                print(f"{worker_id}: queue finished, ran {completed} points, {queue.status()}")
+                return completed
+            time.sleep(poll_interval)
+            continue
+
+        print(f"{worker_id}: running {record['id']} (attempt {record['attempts']})")
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(queue.heartbeat_interval):
+                queue.heartbeat(record['id'])
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        start = time.time()
+        try:
+            result = job(**record['params'])
+        except Exception as e:
+            state = queue.finish(record, 'failed', error=repr(e), seconds=time.time() - start)
+            print(f"{worker_id}: {record['id']} raised {e!r}, moved to {state}")
+        else:
+            queue.finish(record, 'done', result=result, seconds=time.time() - start)
+            completed += 1
+        finally:
+            stop.set()
+            heartbeat_thread.join()
+
+def _demo_job(value, seconds):
+    time.sleep(seconds)
+    return value ** 2
+
+def _demo_worker(queue_folder, points):
+    queue = WorkQueue(queue_folder, stale_after=3.0, heartbeat_interval=0.5)
+    queue.populate(points)
+    return run_worker(queue, _demo_job, poll_interval=0.5)
+
+if __name__ == '__main__':
+    # local check: 4 worker processes on one temp folder, every point should end up in done/ exactly once
+    import multiprocessing
+    import tempfile
+    points = [{'id': f'point-{i}', 'params': {'value': i, 'seconds': 0.2}} for i in range(20)]
+    with tempfile.TemporaryDirectory() as queue_folder:
+        with multiprocessing.Pool(4) as pool:
+            completed = pool.starmap(_demo_worker, [(queue_folder, points)] * 4)
+        queue = WorkQueue(queue_folder, stale_after=3.0, heartbeat_interval=0.5)
+        print(f"points finished per worker: {completed}, final status: {queue.status()}")
+        assert queue.status()['done'] == len(points)
@@ -0,0 +1,65 @@
+"""
+tests for custom-scripts/batched_klip.py: the batched subtraction against a plain one-variant-at-a-time SVD KLIP
+run with `python -m pytest tests` from the repository root
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'custom-scripts'))
+from batched_klip import batched_klip_subtract, klip_regions
+
+def svd_klip(target, references, numbasis=None, annuli=10, subsections=10):
+    """
+    textbook KLIP, one variant and one region at a time: KL modes from the SVD of the mean-subtracted references
+    """
+    frames, rows, columns = target.shape
+    target_flat = target.reshape(frames, -1)
+    references_flat = references.reshape(references.shape[0], -1)
+    residual = np.full(target_flat.shape, np.nan)
+    for region in klip_regions((rows, columns), annuli=annuli, subsections=subsections):
+        t = target_flat[:, region] - np.nanmean(target_flat[:, region], axis=1, keepdims=True)
+        r = references_flat[:, region] - np.nanmean(references_flat[:, region], axis=1, keepdims=True)
+        t, r = np.nan_to_num(t), np.nan_to_num(r)
+        _, singular_values, modes = np.linalg.svd(r, full_matrices=False)
+        modes = modes[singular_values > singular_values[0] * 1e-6][:numbasis]
+        residual[:, region] = t - (t @ modes.T) @ modes
+    residual[np.isnan(target_flat)] = np.nan
+    return residual.reshape(frames, rows, columns)
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(33)
+    y, x = np.indices((41, 37))
+    star = np.exp(-((y - 20) ** 2 + (x - 18) ** 2) / 30.0) * 100
+    target = star + rng.normal(0, 1, (2, 41, 37)) # two rolls
+    references = star * rng.uniform(0.8, 1.2, (5, 3, 1, 1)) + rng.normal(0, 1, (5, 3, 41, 37)) # 5 variants x 3 reference frames
+    references[1, 0, 5:9, 4:20] = np.nan # a bad patch in one reference frame
+    return target, references
+
+@pytest.mark.parametrize('numbasis', [None, 2])
+def test_matches_per_variant_svd_klip(images, numbasis):
+    target, references = images
+    residuals = batched_klip_subtract(target, references, numbasis=numbasis, annuli=4, subsections=3, variants_per_batch=2)
+    assert residuals.shape == (5, 2, 41, 37)
+    for variant in range(references.shape[0]):
+        expected = svd_klip(target, references[variant], numbasis=numbasis, annuli=4, subsections=3)
+        np.testing.assert_allclose(residuals[variant], expected, rtol=0, atol=1e-9)
+
+def test_single_image_and_single_reference_shapes(images):
+    target, references = images
+    residuals = batched_klip_subtract(target[0], references[:, 0], annuli=4, subsections=3)
+    assert residuals.shape == (5, 41, 37)
+    np.testing.assert_allclose(residuals[3], svd_klip(target[:1], references[3, :1], annuli=4, subsections=3)[0], rtol=0, atol=1e-9)
+
+def test_reference_without_data_gives_nan_not_the_target(images):
+    target, references = images
+    references = references[:, :1].copy()
+    references[2] = np.nan # no usable reference at all for this variant
+    references[4, 0, :, :] = 7.0 # flat reference, zero variance everywhere
+    residuals = batched_klip_subtract(target, references, annuli=4, subsections=3)
+    assert np.isnan(residuals[2]).all()
+    assert np.isnan(residuals[4]).all()
+    assert not np.isnan(residuals[[0, 1, 3]]).any() # the other variants in the same batch are unaffected
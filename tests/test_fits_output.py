@@ -0,0 +1,64 @@
+"""
+tests for custom-scripts/fits_output.py: lossless defaults, bundles, and reading bundles back like a folder of maps
+run with `python -m pytest tests` from the repository root
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'custom-scripts'))
+from fits_output import MapBundle, OutputSettings, expand_bundles, multiscale_bundle, read_bundle, read_map, write_map
+from prefetch_io import list_fits_files, prefetch_fits_files
+
+@pytest.fixture
+def maps():
+    rng = np.random.default_rng(26)
+    return {f'R{i}-std': rng.normal(size=(12, 15)) + i for i in range(3)}
+
+def test_default_output_is_lossless(tmp_path, maps):
+    data_array = maps['R0-std']
+    for compression in (None, 'GZIP_2'):
+        write_map(data_array, None, str(tmp_path / 'map.fits'), OutputSettings(compression=compression))
+        np.testing.assert_array_equal(read_map(str(tmp_path / 'map.fits'))[0], data_array)
+    with pytest.raises(ValueError):
+        OutputSettings(compression='RICE_1') # quantizing has to be asked for
+
+@pytest.mark.parametrize('bundle_format', ['fits', 'npz'])
+def test_bundle_reads_back_like_a_folder_of_maps(tmp_path, maps, bundle_format):
+    with MapBundle(str(tmp_path / 'std-maps'), OutputSettings(bundle=bundle_format)) as bundle:
+        for name, data_array in maps.items():
+            bundle.add(name, data_array)
+    write_map(maps['R0-std'] * 2, None, str(tmp_path / 'plain-std.fits')) # plain maps sit next to bundles fine
+
+    assert list(read_bundle(bundle.output_path)) == list(maps) # same keys for both formats
+
+    file_paths = list_fits_files(str(tmp_path))
+    assert sorted(os.path.basename(file_path) for file_path in file_paths) == ['R0-std.fits', 'R1-std.fits', 'R2-std.fits', 'plain-std.fits']
+    for file_path, data_array, _ in prefetch_fits_files(file_paths):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        expected = maps['R0-std'] * 2 if name == 'plain-std' else maps[name]
+        np.testing.assert_array_equal(data_array, expected)
+
+def test_single_compressed_map_is_not_a_bundle(tmp_path, maps):
+    path = str(tmp_path / 'map.fits')
+    write_map(maps['R0-std'], None, path, OutputSettings(compression='GZIP_2'))
+    assert expand_bundles([path]) == [path]
+
+def test_clashing_map_names_across_bundles_are_rejected(tmp_path, maps):
+    for bundle_name in ('first', 'second'):
+        with MapBundle(str(tmp_path / bundle_name), OutputSettings(bundle='fits')) as bundle:
+            bundle.add('R0-std', maps['R0-std'])
+    with pytest.raises(ValueError):
+        list_fits_files(str(tmp_path))
+
+@pytest.mark.parametrize('bundle_format', ['fits', 'npz'])
+def test_multiscale_bundle_without_input_header(tmp_path, maps, bundle_format):
+    scales = [(4.5e-6, 5.2, 2.8), (3.56e-6, 6.5, 1.8)]
+    bundle = multiscale_bundle(str(tmp_path), 'R0', scales, [maps['R0-std'], maps['R1-std']], None, OutputSettings(bundle=bundle_format))
+    assert list(read_bundle(bundle.close())) == ['R0-std-4.5um-5.2m', 'R0-std-3.56um-6.5m']
+    if bundle_format == 'fits':
+        data_array, header = read_map(str(tmp_path / 'R0-std-multiscale.fits' / 'R0-std-3.56um-6.5m.fits'))
+        np.testing.assert_array_equal(data_array, maps['R1-std'])
+        assert (header['WAVELEN'], header['APERTURE'], header['LAMBDAD']) == (3.56e-6, 6.5, 1.8)
@@ -0,0 +1,90 @@
+"""
+tests for custom-scripts/local_noise.py: the vectorized noise maps against a brute-force per-pixel loop over the lambda/D disk
+(the same loop as find_standard_deviation() in infinity-std.py)
+run with `python -m pytest tests` from the repository root
+"""
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'custom-scripts'))
+from local_noise import MAD_TO_SIGMA, find_lambda_over_d, find_local_noise, find_local_std_pyramid
+
+def brute_force_noise(data_array, lambda_over_d, estimator='std'):
+    """
+    one distance mask per pixel, every frame, pixels with distance < lambda_over_d, NaNs ignored
+    """
+    frames, rows, columns = data_array.shape
+    x_coords, y_coords = np.meshgrid(np.arange(rows), np.arange(columns), indexing='ij')
+    noise_array = np.full((rows, columns), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i in range(rows):
+            for j in range(columns):
+                mask = np.sqrt((x_coords - i)**2 + (y_coords - j)**2) < lambda_over_d
+                pixels = data_array[:, mask].ravel()
+                if estimator == 'std':
+                    noise_array[i, j] = np.nanstd(pixels)
+                elif estimator == 'mad':
+                    noise_array[i, j] = MAD_TO_SIGMA * np.nanmedian(np.abs(pixels - np.nanmedian(pixels)))
+                elif estimator == 'percentile':
+                    low, high = np.nanpercentile(pixels, [15.87, 84.13])
+                    noise_array[i, j] = (high - low) / 2
+                elif estimator == 'sigma_clip':
+                    pixels = pixels.copy()
+                    for _ in range(5):
+                        outliers = np.abs(pixels - np.nanmedian(pixels)) > 3.0 * np.nanstd(pixels)
+                        if not outliers.any():
+                            break
+                        pixels[outliers] = np.nan
+                    noise_array[i, j] = np.nanstd(pixels)
+    return noise_array
+
+@pytest.fixture
+def cube():
+    rng = np.random.default_rng(28)
+    data_array = rng.normal(10.0, 2.0, (2, 17, 23)) # non-square on purpose, a transposed map can't pass
+    data_array[0, 3:5, 6:9] = np.nan
+    data_array[:, 12, 20] = np.nan
+    data_array[1, 8, 4] = 500.0 # hot pixel
+    return data_array
+
+@pytest.mark.parametrize('estimator', ['std', 'mad', 'percentile', 'sigma_clip'])
+@pytest.mark.parametrize('lambda_over_d', [1.5, find_lambda_over_d(4.5e-6, 5.2), 4.0])
+def test_matches_brute_force(cube, estimator, lambda_over_d):
+    expected = brute_force_noise(cube, lambda_over_d, estimator)
+    noise_array = find_local_noise(cube, lambda_over_d, estimator=estimator, rows_per_chunk=5)
+    assert noise_array.shape == (17, 23)
+    np.testing.assert_allclose(noise_array, expected, rtol=1e-10, atol=1e-10)
+
+def test_single_image_and_all_nan_neighbourhood():
+    data_array = np.random.default_rng(1).normal(size=(9, 11))
+    data_array[:5, :5] = np.nan
+    noise_array = find_local_noise(data_array, 1.5, estimator='mad')
+    assert np.isnan(noise_array[1, 1]) # nothing but NaN inside the disk
+    np.testing.assert_allclose(noise_array, brute_force_noise(data_array[np.newaxis], 1.5, 'mad'), rtol=1e-10, atol=1e-10)
+
+def test_unknown_estimator():
+    with pytest.raises(ValueError):
+        find_local_noise(np.zeros((5, 5)), 2.0, estimator='iqr')
+
+def test_pyramid_matches_brute_force_for_every_radius(cube):
+    radii = [4.0, 1.5, find_lambda_over_d(4.5e-6, 5.2), find_lambda_over_d(3.56e-6, 5.2), 2.0] # unsorted, 2.0 sits exactly on a ring of offsets
+    std_maps = find_local_std_pyramid(cube, radii)
+    assert len(std_maps) == len(radii)
+    for lambda_over_d, std_map in zip(radii, std_maps):
+        np.testing.assert_allclose(std_map, brute_force_noise(cube, lambda_over_d, 'std'), rtol=1e-10, atol=1e-10)
+
+def test_pyramid_with_duplicate_radii(cube):
+    std_maps = find_local_std_pyramid(cube, [2.5, 1.5, 2.5])
+    np.testing.assert_array_equal(std_maps[0], std_maps[2])
+    np.testing.assert_allclose(std_maps[0], brute_force_noise(cube, 2.5, 'std'), rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(std_maps[1], brute_force_noise(cube, 1.5, 'std'), rtol=1e-10, atol=1e-10)
+
+def test_pyramid_keeps_precision_with_a_large_offset(cube):
+    # sum-of-squares on data sitting far from zero loses digits unless the mean is taken out first
+    std_map, = find_local_std_pyramid(cube + 1e6, [2.0])
+    np.testing.assert_allclose(std_map, brute_force_noise(cube + 1e6, 2.0, 'std'), rtol=1e-6)
@@ -0,0 +1,33 @@
+"""
+tests for custom-scripts/shared_handoff.py: summaries for every array, even when an analysis process dies on one
+run with `python -m pytest tests` from the repository root
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'custom-scripts'))
+from shared_handoff import AnalysisPool
+
+def total_or_die(data_array, descriptor):
+    # picklable stand-in for LossAnalysis, spawned processes import it from this file
+    if descriptor['name'] == 'kill':
+        os._exit(3) # like the OOM killer, no exception and no summary
+    if descriptor['name'] == 'raise':
+        raise ValueError('bad array')
+    return {'name': descriptor['name'], 'params': descriptor['params'], 'total': float(data_array.sum())}
+
+def test_wait_and_close_survive_a_dead_analysis_process():
+    pool = AnalysisPool(analysis=total_or_die, processes=1, poll_interval=0.2)
+    first = pool.submit(np.ones((4, 5)), {'point': 0}, name='first')
+    assert pool.wait(first, timeout=60)['total'] == 20.0
+    killed = pool.submit(np.ones((4, 5)), name='kill')
+    pool.submit(np.ones((4, 5)), name='raise')
+    pool.submit(np.full((4, 5), 2.0), name='after')
+
+    assert 'died' in pool.wait(killed, timeout=60)['error']
+    summaries = pool.close(timeout=60)
+    assert [summary['name'] for summary in summaries] == ['first', 'kill', 'raise', 'after']
+    assert 'ValueError' in summaries[2]['error']
+    assert summaries[3]['total'] == 40.0 # the replacement process picked up the rest of the queue
@@ -0,0 +1,141 @@
+"""
+tests for pancake-simulations/work_queue.py: reclaiming dead claims, and the races between claim() and reclaim_stale()
+run with `python -m pytest tests` from the repository root
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'pancake-simulations'))
+import work_queue
+from work_queue import WorkQueue
+
+HOURS_AGO = 3 * 3600
+
+def make_queue(folder, n_points=1):
+    queue = WorkQueue(str(folder), stale_after=60.0, heartbeat_interval=5.0)
+    queue.populate([{'id': f'point-{i}', 'params': {'value': i}} for i in range(n_points)])
+    return queue
+
+def backdate(path, seconds=HOURS_AGO):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+def hook_claim_rename(monkeypatch, action):
+    """
+    run action() once, right after claim() renames a point into claimed/ and before it does anything else, like a second worker would
+    """
+    real_rename = os.rename
+    state = {'done': False}
+
+    def rename(source, destination):
+        real_rename(source, destination)
+        if not state['done'] and os.sep + 'pending' + os.sep in str(source) and os.sep + 'claimed' + os.sep in str(destination):
+            state['done'] = True
+            action()
+
+    monkeypatch.setattr(work_queue.os, 'rename', rename)
+    return state
+
+def test_backdated_claim_is_reclaimed(tmp_path):
+    queue = make_queue(tmp_path)
+    record = queue.claim('dead-worker')
+    assert record['attempts'] == 1
+    backdate(queue.path('claimed', 'point-0'))
+
+    assert queue.reclaim_stale('other-worker') == ['point-0']
+    assert queue.status() == {'pending': 1, 'claimed': 0, 'done': 0, 'failed': 0}
+    assert 'claimed_at' not in queue.read_record('pending', 'point-0')
+
+    record = queue.claim('other-worker')
+    assert record['attempts'] == 2
+    assert record['worker'] == 'other-worker'
+
+def test_fresh_claim_is_not_reclaimed(tmp_path):
+    queue = make_queue(tmp_path)
+    backdate(queue.path('pending', 'point-0')) # queued hours ago, claimed just now
+    queue.claim('worker')
+    assert queue.reclaim_stale('other-worker') == []
+    assert queue.status()['claimed'] == 1
+
+def test_claim_out_of_attempts_goes_to_failed(tmp_path):
+    queue = make_queue(tmp_path)
+    for _ in range(queue.max_attempts):
+        queue.claim('dead-worker')
+        backdate(queue.path('claimed', 'point-0'))
+        queue.reclaim_stale('other-worker')
+    assert queue.status() == {'pending': 0, 'claimed': 0, 'done': 0, 'failed': 1}
+
+@pytest.mark.parametrize('earlier_attempts', [0, 1])
+def test_reclaim_right_after_claim_rename_does_not_duplicate(tmp_path, monkeypatch, earlier_attempts):
+    queue = make_queue(tmp_path)
+    for _ in range(earlier_attempts): # a point that already came back from a dead worker once
+        queue.claim('dead-worker')
+        backdate(queue.path('claimed', 'point-0'))
+        queue.reclaim_stale('other-worker')
+    backdate(queue.path('pending', 'point-0'))
+
+    reclaimed = []
+    hook_claim_rename(monkeypatch, lambda: reclaimed.extend(queue.reclaim_stale('other-worker')))
+    record = queue.claim('worker')
+
+    assert reclaimed == []
+    assert record['attempts'] == earlier_attempts + 1
+    assert queue.status() == {'pending': 0, 'claimed': 1, 'done': 0, 'failed': 0}
+
+def test_claim_survives_losing_the_point_after_rename(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, n_points=2)
+    # the point vanishes from claimed/ right after the rename (e.g. an older worker finishing it), claim moves on
+    hook_claim_rename(monkeypatch, lambda: os.remove(queue.path('claimed', 'point-0')))
+    record = queue.claim('worker')
+    assert record['id'] == 'point-1'
+    assert queue.status()['claimed'] == 1
+
+def test_failed_point_requeued_without_claimed_at(tmp_path):
+    queue = make_queue(tmp_path)
+    record = queue.claim('worker')
+    assert queue.finish(record, 'failed', error='boom') == 'pending'
+    assert 'claimed_at' not in queue.read_record('pending', 'point-0')
+    assert queue.status() == {'pending': 1, 'claimed': 0, 'done': 0, 'failed': 0}
+
+def later(monkeypatch, queue, seconds):
+    real_now = queue.filesystem_now
+    monkeypatch.setattr(queue, 'filesystem_now', lambda worker_id: real_now(worker_id) + seconds)
+
+def test_claim_never_written_is_reclaimed_after_another_period(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    backdate(queue.path('pending', 'point-0'))
+    # a worker that died between claim()'s rename and its record write: old mtime, no claimed_at
+    os.rename(queue.path('pending', 'point-0'), queue.path('claimed', 'point-0'))
+
+    assert queue.reclaim_stale('other-worker') == [] # could still be a live claim() about to write
+    later(monkeypatch, queue, queue.stale_after + 1)
+    assert queue.reclaim_stale('other-worker') == ['point-0']
+    assert queue.status() == {'pending': 1, 'claimed': 0, 'done': 0, 'failed': 0}
+    assert queue.claim('other-worker')['attempts'] == 1
+
+@pytest.mark.parametrize('died_after_write', [False, True])
+def test_half_done_reclaim_is_finished(tmp_path, monkeypatch, died_after_write):
+    queue = make_queue(tmp_path)
+    queue.claim('dead-worker')
+    backdate(queue.path('claimed', 'point-0'))
+    # a reclaimer killed between its two renames
+    left_path = f"{queue.path('pending', 'point-0')}.dead-reclaimer.reclaim"
+    os.rename(queue.path('claimed', 'point-0'), left_path)
+    if died_after_write: # ...after it already dropped claimed_at
+        with open(left_path) as file:
+            record = json.load(file)
+        record.pop('claimed_at')
+        with open(left_path, 'w') as file:
+            json.dump(record, file)
+    assert queue.status() == {'pending': 0, 'claimed': 0, 'done': 0, 'failed': 0}
+
+    assert queue.reclaim_stale('other-worker') == [] # its reclaimer could still be about to rename it
+    later(monkeypatch, queue, queue.stale_after + 1)
+    assert queue.reclaim_stale('other-worker') == ['point-0']
+    assert queue.status() == {'pending': 1, 'claimed': 0, 'done': 0, 'failed': 0}
+    assert 'claimed_at' not in queue.read_record('pending', 'point-0')
+    assert os.listdir(tmp_path / 'pending') == ['point-0.json']